@@ -1,25 +1,53 @@
 import streamlit as st
+import pandas as pd
 import logging
 import asyncio
 import time
 import os
+import threading
+import queue
+import sqlite3
+import json
+import hashlib
+import hmac
+import tempfile
+import shutil
+import uuid
+import subprocess
+import argparse
+import cProfile
+import datetime
+import pstats
+import io
 import unicodedata
 import re
 import spacy
 import difflib
-from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
+import numpy as np
+from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError, Error as PlaywrightError
 from PyPDF2 import PdfReader
 from docx import Document
 from docx.shared import Pt
 from io import BytesIO
+from collections import deque
+from contextlib import closing, contextmanager
 
 # Bibliotecas para OCR e imagem
 from pdf2image import convert_from_path
 import pytesseract
 from PIL import Image, ImageEnhance, ImageFilter
 
-# Criptografia de dados (exemplo simples)
-from cryptography.fernet import Fernet
+# Motor de OCR opcional que mantém o Tesseract carregado em memória
+try:
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+# Índice local de CEP (arquivo binário gerado por cep_index.py)
+from cep_index import CepIndex, cep_to_int, uf_for_cep
+
+# Criptografia de dados (cofre de credenciais)
+from cryptography.fernet import Fernet, MultiFernet, InvalidToken
 
 # Configuração básica de logs
 logging.basicConfig(level=logging.ERROR)
@@ -35,10 +63,177 @@ if os.name == 'nt':
 LOGIN_URL = "https://sei.anvisa.gov.br/sip/login.php?sigla_orgao_sistema=ANVISA&sigla_sistema=SEI"
 
 ###############################################################################
-# Criptografia básica (chave em memória)
+# Cofre de credenciais (chave compartilhada entre processos)
 ###############################################################################
-secret_key = Fernet.generate_key()
-cipher_suite = Fernet(secret_key)
+# As chaves vêm da variável de ambiente (separadas por vírgula) ou do arquivo de
+# chaves (uma por linha). A primeira cifra; as demais só decifram, o que permite
+# rotacionar a chave sem invalidar tokens emitidos antes da rotação.
+VAULT_KEYS_ENV = "ANAVISA_VAULT_KEYS"
+VAULT_KEY_FILE = os.environ.get("ANAVISA_VAULT_KEY_FILE", os.path.join(os.getcwd(), ".vault_keys"))
+CREDENTIAL_TOKEN_TTL = 12 * 60 * 60  # validade do token cifrado (segundos)
+CREDENTIAL_LEASE_SECONDS = 15 * 60  # validade das credenciais decifradas em memória
+
+class CredentialLease:
+    """
+    Credenciais decifradas, válidas apenas até expires_at.
+    """
+
+    def __init__(self, username, password, expires_at):
+        self.username = username
+        self.password = password
+        self.expires_at = expires_at
+
+    @property
+    def expired(self):
+        return time.time() >= self.expires_at
+
+    def __repr__(self):
+        return f"CredentialLease(username={self.username!r}, expires_at={self.expires_at:.0f})"
+
+# Releituras de um arquivo de chaves vazio ou incompleto antes de desistir
+VAULT_KEY_READ_ATTEMPTS = 5
+
+def _write_vault_key_temp(key_file, keys):
+    """
+    Grava as chaves num temporário (permissão 600) no mesmo diretório do arquivo
+    final, pronto para ser publicado de uma vez com os.link/os.replace.
+    """
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(key_file)), prefix=".vault_keys.")
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(keys) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+    return temp_path
+
+def _read_vault_key_file(key_file):
+    """
+    Chaves válidas do arquivo, ou None se ele está vazio ou com alguma chave incompleta.
+    """
+    with open(key_file, encoding="ascii") as f:
+        keys = [line.strip() for line in f if line.strip()]
+    try:
+        for key in keys:
+            Fernet(key)
+    except ValueError:
+        return None
+    return keys or None
+
+def load_vault_keys(key_file=VAULT_KEY_FILE):
+    """
+    Lê as chaves do ambiente ou do arquivo; sem nenhuma das duas, cria o arquivo
+    com uma chave nova (permissão 600), que os demais workers passam a usar.
+    - A chave nova é publicada com os.link a partir de um temporário completo: se
+      outro worker criou o arquivo antes, o link falha e vale a chave dele, de modo
+      que todos leem a mesma chave e nunca um arquivo pela metade.
+    """
+    env_keys = os.environ.get(VAULT_KEYS_ENV, "")
+    keys = [k.strip() for k in env_keys.split(",") if k.strip()]
+    if keys:
+        return keys
+
+    if not os.path.exists(key_file):
+        temp_path = _write_vault_key_temp(key_file, [Fernet.generate_key().decode("ascii")])
+        try:
+            os.link(temp_path, key_file)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temp_path)
+
+    for attempt in range(VAULT_KEY_READ_ATTEMPTS):
+        keys = _read_vault_key_file(key_file)
+        if keys:
+            return keys
+        time.sleep(0.2 * (attempt + 1))
+    logging.error(f"Arquivo de chaves do cofre vazio ou inválido: {key_file}")
+    raise Exception(f"Arquivo de chaves do cofre vazio ou inválido: {key_file}")
+
+def rotate_vault_key(key_file=VAULT_KEY_FILE, keep=3):
+    """
+    Gera uma nova chave primária no arquivo, mantendo as `keep` anteriores para decifrar
+    tokens antigos. (Com chaves no ambiente, a rotação é feita na própria variável.)
+    """
+    keys = load_vault_keys(key_file) if os.path.exists(key_file) else []
+    keys = [Fernet.generate_key().decode("ascii")] + keys[:keep]
+    os.replace(_write_vault_key_temp(key_file, keys), key_file)
+
+class CredentialVault:
+    """
+    Cifra as credenciais num token que qualquer processo com acesso à mesma chave
+    consegue decifrar. Cada processo decifra um token uma única vez e guarda o
+    resultado como um lease de curta duração.
+    """
+
+    def __init__(self, key_file=VAULT_KEY_FILE, lease_seconds=CREDENTIAL_LEASE_SECONDS):
+        self.key_file = key_file
+        self.lease_seconds = lease_seconds
+        self._lock = threading.Lock()
+        self._leases = {}
+        self._load_keys()
+
+    def _load_keys(self):
+        keys = load_vault_keys(self.key_file)
+        self._fernet = MultiFernet([Fernet(key) for key in keys])
+        self._scope_key = keys[0].encode("ascii")
+
+    def seal(self, username, password):
+        payload = json.dumps({"username": username, "password": password}).encode("utf-8")
+        return self._fernet.encrypt(payload)
+
+    def _decrypt(self, token):
+        try:
+            return self._fernet.decrypt(token, ttl=CREDENTIAL_TOKEN_TTL)
+        except InvalidToken:
+            # A chave pode ter sido rotacionada por outro processo: recarrega e tenta de novo
+            self._load_keys()
+            return self._fernet.decrypt(token, ttl=CREDENTIAL_TOKEN_TTL)
+
+    def lease(self, token):
+        """
+        Retorna as credenciais do token, decifrando apenas se não houver lease válido.
+        """
+        with self._lock:
+            lease = self._leases.get(token)
+            if lease is not None and not lease.expired:
+                return lease
+            try:
+                payload = json.loads(self._decrypt(token))
+            except InvalidToken:
+                raise Exception("Credenciais expiradas ou inválidas. Informe usuário e senha novamente.")
+            lease = CredentialLease(payload["username"], payload["password"], time.time() + self.lease_seconds)
+            self._leases[token] = lease
+            # Descarta leases vencidos para não acumular senhas em memória
+            self._leases = {t: l for t, l in self._leases.items() if not l.expired}
+            return lease
+
+    def scope(self, token):
+        """
+        Identificador do par usuário/senha do token (HMAC com a chave do cofre), sem
+        revelar as credenciais. Serve para restringir resultados em cache a quem
+        já se autenticou no SEI com exatamente essas credenciais.
+        """
+        credentials = self.lease(token)
+        message = f"{credentials.username}\0{credentials.password}".encode("utf-8")
+        return hmac.new(self._scope_key, message, hashlib.sha256).hexdigest()
+
+    def revoke(self, token):
+        with self._lock:
+            self._leases.pop(token, None)
+
+    def rotate_token(self, token):
+        """
+        Recifra o token com a chave primária atual (após rotate_vault_key).
+        """
+        self._load_keys()
+        return self._fernet.rotate(token)
+
+@st.cache_resource
+def get_credential_vault():
+    """
+    Cofre compartilhado por todas as sessões do servidor Streamlit.
+    Workers em outros processos criam o seu com CredentialVault(), usando a mesma chave.
+    """
+    return CredentialVault()
 
 ###############################################################################
 # Funções de Validação de CPF e CNPJ
@@ -67,7 +262,7 @@ def validar_cnpj(cnpj: str) -> bool:
         return False
     
     def calc_dv(cnpj_parcial):
-        peso = [6,7,8,9,2,3,4,5]
+        peso = [2,3,4,5,6,7,8,9]
         soma = 0
         for i, digit in enumerate(cnpj_parcial[::-1]):
             soma += int(digit) * peso[i % len(peso)]
@@ -81,11 +276,337 @@ def validar_cnpj(cnpj: str) -> bool:
 ###############################################################################
 # Funções relacionadas ao Playwright
 ###############################################################################
-def create_browser_context(headless=True):
-    download_dir = os.path.join(os.getcwd(), "downloads")
+class SEITimeoutError(Exception):
+    """
+    O SEI não respondeu dentro do tempo limite. Falha transitória: pode ser repetida.
+    """
+    pass
+
+class SEIElementNotFoundError(Exception):
+    """
+    A página do SEI carregou, mas sem o elemento esperado (ex.: número de processo
+    inexistente ou sem acesso). Erro de negócio: não conta como falha do SEI.
+    """
+    pass
+
+class SEIUnavailableError(Exception):
+    """
+    Circuito aberto: o SEI vem falhando e novas requisições estão suspensas
+    até retry_at (timestamp). Também é transitória.
+    """
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+###############################################################################
+# Tempos limite adaptativos e circuit breaker do SEI
+###############################################################################
+# Tempos limite (ms) por operação, usados enquanto não há amostras suficientes
+SEI_DEFAULT_TIMEOUTS = {
+    "navegacao": 30000,
+    "elemento": 20000,
+    "login": 20000,
+    "processo": 40000,
+    "gerar_pdf": 10000,
+    "download": 60000,
+}
+SEI_LATENCY_WINDOW = 200  # amostras recentes por operação
+SEI_LATENCY_MIN_SAMPLES = 10
+SEI_TIMEOUT_PERCENTILE = 95
+SEI_TIMEOUT_FACTOR = 2.0  # folga sobre o percentil
+SEI_TIMEOUT_MIN_FACTOR = 0.5  # piso: metade do tempo limite padrão
+SEI_TIMEOUT_MAX_FACTOR = 3  # teto: 3x o tempo limite padrão
+
+SEI_BREAKER_FAILURE_THRESHOLD = 5  # falhas seguidas para abrir o circuito
+SEI_BREAKER_RESET_SECONDS = 60  # tempo aberto antes da requisição de teste
+# Falhas que indicam SEI lento ou fora do ar: timeouts de navegação, login e download
+# e erros de transporte. Erros de negócio (incluindo SEIElementNotFoundError) não contam.
+SEI_FAILURE_ERRORS = (SEITimeoutError, PlaywrightError)
+
+class LatencyTracker:
+    """
+    Latências recentes por operação do SEI. O tempo limite de cada operação
+    acompanha o percentil 95 observado (com folga), entre SEI_TIMEOUT_MIN_FACTOR e
+    SEI_TIMEOUT_MAX_FACTOR vezes o padrão.
+    - Timeouts entram como amostras com o próprio tempo limite, para que o
+      limite cresça quando o SEI fica lento.
+    """
+
+    def __init__(self, window=SEI_LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._window = window
+
+    def record(self, operation, seconds):
+        with self._lock:
+            self._samples.setdefault(operation, deque(maxlen=self._window)).append(seconds)
+
+    def percentile(self, operation, q):
+        with self._lock:
+            samples = list(self._samples.get(operation, ()))
+        if not samples:
+            return None
+        return float(np.percentile(samples, q))
+
+    def timeout_ms(self, operation):
+        default = SEI_DEFAULT_TIMEOUTS[operation]
+        with self._lock:
+            count = len(self._samples.get(operation, ()))
+        if count < SEI_LATENCY_MIN_SAMPLES:
+            return default
+        adaptive = self.percentile(operation, SEI_TIMEOUT_PERCENTILE) * SEI_TIMEOUT_FACTOR * 1000
+        return int(min(max(adaptive, default * SEI_TIMEOUT_MIN_FACTOR), default * SEI_TIMEOUT_MAX_FACTOR))
+
+    def summary(self):
+        """
+        [{'operacao', 'amostras', 'p50_s', 'p95_s', 'timeout_ms'}] para exibição.
+        """
+        with self._lock:
+            operations = {op: len(samples) for op, samples in self._samples.items()}
+        return [
+            {
+                "operacao": op,
+                "amostras": count,
+                "p50_s": round(self.percentile(op, 50), 2),
+                "p95_s": round(self.percentile(op, 95), 2),
+                "timeout_ms": self.timeout_ms(op),
+            }
+            for op, count in sorted(operations.items())
+        ]
+
+class CircuitBreaker:
+    """
+    Estados: 'fechado' (normal), 'aberto' (requisições recusadas até o fim da
+    espera) e 'meio-aberto' (uma requisição de teste; sucesso fecha, falha reabre).
+    """
+
+    def __init__(self, failure_threshold=SEI_BREAKER_FAILURE_THRESHOLD, reset_seconds=SEI_BREAKER_RESET_SECONDS):
+        self._lock = threading.Lock()
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "fechado"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def retry_at(self):
+        return self.opened_at + self.reset_seconds
+
+    def before_call(self):
+        """
+        Autoriza uma requisição ao SEI ou levanta SEIUnavailableError.
+        """
+        with self._lock:
+            if self.state == "aberto":
+                if time.time() < self.retry_at:
+                    raise SEIUnavailableError("SEI indisponível: circuito aberto após falhas seguidas.", self.retry_at)
+                self.state = "meio-aberto"
+            if self.state == "meio-aberto":
+                if self._probe_in_flight:
+                    raise SEIUnavailableError("SEI em teste: aguardando a requisição de verificação.", time.time() + 5)
+                self._probe_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "fechado"
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "meio-aberto" or self.failures >= self.failure_threshold:
+                if self.state != "aberto":
+                    logging.error(f"Circuito do SEI aberto após {self.failures} falha(s).")
+                self.state = "aberto"
+                self.opened_at = time.time()
+            self._probe_in_flight = False
+
+    def release(self):
+        """
+        Encerra uma requisição sem veredito (erro alheio ao SEI), liberando o teste.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+@st.cache_resource
+def get_latency_tracker():
+    """
+    Latências compartilhadas por todas as sessões e workers deste servidor.
+    """
+    return LatencyTracker()
+
+@st.cache_resource
+def get_circuit_breaker():
+    """
+    Circuit breaker do SEI compartilhado por todas as sessões e workers deste servidor.
+    """
+    return CircuitBreaker()
+
+def sei_timeout(operation):
+    return get_latency_tracker().timeout_ms(operation)
+
+@contextmanager
+def track_latency(operation, timeout_ms):
+    """
+    Mede a operação; em timeout, registra o próprio tempo limite como amostra.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except PlaywrightTimeoutError:
+        get_latency_tracker().record(operation, timeout_ms / 1000)
+        raise
+    get_latency_tracker().record(operation, time.perf_counter() - start)
+
+def run_with_adaptive_timeout(operation, action, timeout=None):
+    """
+    Executa action(timeout_ms) com o tempo limite adaptativo da operação. Se ele,
+    menor que o padrão, estourar, repete uma vez com o tempo limite padrão: só o
+    estouro no padrão chega ao chamador (e conta como falha no circuito do SEI).
+    """
+    timeout = timeout or sei_timeout(operation)
+    default = SEI_DEFAULT_TIMEOUTS[operation]
+    try:
+        with track_latency(operation, timeout):
+            return action(timeout)
+    except PlaywrightTimeoutError:
+        if timeout >= default:
+            raise
+        logging.warning(
+            f"Tempo limite adaptativo de '{operation}' ({timeout} ms) esgotado; repetindo com o padrão ({default} ms)."
+        )
+    with track_latency(operation, default):
+        return action(default)
+
+###############################################################################
+# Pool de navegadores (um perfil por sessão, concorrência limitada)
+###############################################################################
+BROWSER_PROFILES_DIR = os.path.join(os.getcwd(), "user_data")
+BROWSER_DOWNLOADS_DIR = os.path.join(os.getcwd(), "downloads")
+# Navegadores abertos ao mesmo tempo neste servidor
+BROWSER_MAX_CONCURRENCY = int(os.environ.get("ANAVISA_BROWSER_CONCURRENCY", "2"))
+# Perfis e downloads sem uso há mais que isso são apagados
+BROWSER_PROFILE_MAX_AGE = 24 * 60 * 60
+
+def browser_dirs(session_id):
+    """
+    Diretórios de perfil e de downloads exclusivos da sessão. O Chromium trava o
+    diretório de perfil, então duas sessões nunca podem compartilhá-lo.
+    """
+    return (
+        os.path.join(BROWSER_PROFILES_DIR, session_id),
+        os.path.join(BROWSER_DOWNLOADS_DIR, session_id),
+    )
+
+def default_browser_session_id():
+    """
+    Identificador para chamadas fora de uma sessão do Streamlit (ex.: worker em outro processo).
+    """
+    return f"worker-{os.getpid()}-{threading.get_ident()}"
+
+class BrowserPool:
+    """
+    Limita os navegadores abertos a max_concurrency, atendendo em ordem de chegada.
+    Quem espera recebe a posição na fila via on_wait(posição); 0 = liberado.
+    - Uma sessão só abre um navegador por vez: o perfil (user_data_dir) do Chromium
+      não pode ser usado por dois processos. Um segundo pedido da mesma sessão espera
+      o primeiro terminar, sem bloquear os pedidos de outras sessões atrás dele.
+    """
+
+    def __init__(self, max_concurrency=BROWSER_MAX_CONCURRENCY):
+        self.max_concurrency = max_concurrency
+        self._condition = threading.Condition()
+        self._waiting = deque()
+        # session_id -> navegadores abertos (todas as aquisições contam no limite)
+        self._active = {}
+
+    def position(self, ticket):
+        return self._waiting.index(ticket) + 1
+
+    def _can_start(self, ticket):
+        if sum(self._active.values()) >= self.max_concurrency:
+            return False
+        # Primeiro da fila cuja sessão não está com o perfil em uso
+        for waiting in self._waiting:
+            if waiting[0] not in self._active:
+                return waiting is ticket
+        return False
+
+    @contextmanager
+    def slot(self, session_id, on_wait=None):
+        ticket = (session_id, object())
+        with self._condition:
+            self._waiting.append(ticket)
+            last_position = None
+            try:
+                while not self._can_start(ticket):
+                    current = self.position(ticket)
+                    if on_wait and current != last_position:
+                        on_wait(current)
+                        last_position = current
+                    self._condition.wait(timeout=1)
+            finally:
+                self._waiting.remove(ticket)
+                self._condition.notify_all()
+            self._active[session_id] = self._active.get(session_id, 0) + 1
+        if on_wait:
+            on_wait(0)
+
+        try:
+            for directory in browser_dirs(session_id):
+                os.makedirs(directory, exist_ok=True)
+                os.utime(directory)
+            yield browser_dirs(session_id)
+        finally:
+            with self._condition:
+                self._active[session_id] -= 1
+                if not self._active[session_id]:
+                    del self._active[session_id]
+                self._condition.notify_all()
+
+    def active_sessions(self):
+        with self._condition:
+            return set(self._active)
+
+    def status(self):
+        with self._condition:
+            return {"ativos": sum(self._active.values()), "fila": len(self._waiting), "limite": self.max_concurrency}
+
+    def cleanup_stale_profiles(self, max_age=BROWSER_PROFILE_MAX_AGE):
+        """
+        Apaga perfis e pastas de download sem uso há mais de max_age segundos.
+        Retorna quantos diretórios foram removidos.
+        """
+        in_use = self.active_sessions()
+        removed = 0
+        for base_dir in (BROWSER_PROFILES_DIR, BROWSER_DOWNLOADS_DIR):
+            if not os.path.isdir(base_dir):
+                continue
+            for entry in os.scandir(base_dir):
+                if not entry.is_dir() or entry.name in in_use:
+                    continue
+                try:
+                    if time.time() - entry.stat().st_mtime > max_age:
+                        shutil.rmtree(entry.path)
+                        removed += 1
+                except OSError as e:
+                    logging.error(f"Erro ao remover o perfil antigo {entry.path}: {e}")
+        return removed
+
+@st.cache_resource
+def get_browser_pool():
+    """
+    Pool compartilhado por todas as sessões deste servidor.
+    """
+    return BrowserPool()
+
+def create_browser_context(headless=True, user_data_dir=None, download_dir=None):
+    download_dir = download_dir or BROWSER_DOWNLOADS_DIR
     os.makedirs(download_dir, exist_ok=True)
     
-    user_data_dir = os.path.join(os.getcwd(), "user_data")
+    user_data_dir = user_data_dir or BROWSER_PROFILES_DIR
     os.makedirs(user_data_dir, exist_ok=True)
     
     playwright = sync_playwright().start()
@@ -99,14 +620,16 @@ def create_browser_context(headless=True):
     page = context.new_page()
     return playwright, context, page
 
-def wait_for_element(page, selector, timeout=20000):
+def wait_for_element(page, selector, timeout=None, operation="elemento"):
     try:
-        element = page.wait_for_selector(selector, timeout=timeout)
+        element = run_with_adaptive_timeout(
+            operation, lambda timeout_ms: page.wait_for_selector(selector, timeout=timeout_ms), timeout
+        )
         if element:
             return element
     except PlaywrightTimeoutError:
         logging.error(f"Elemento {selector} não encontrado na página.")
-        raise Exception(f"Elemento {selector} não encontrado na página.")
+        raise SEIElementNotFoundError(f"Elemento {selector} não encontrado na página.")
     return None
 
 def handle_download(download, download_dir):
@@ -127,11 +650,14 @@ def handle_alert(page):
     except PlaywrightTimeoutError:
         return None
 
-def login(page, username_encrypted, password_encrypted):
-    username = cipher_suite.decrypt(username_encrypted).decode('utf-8')
-    password = cipher_suite.decrypt(password_encrypted).decode('utf-8')
+def login(page, credentials):
+    username = credentials.username
+    password = credentials.password
     
-    page.goto(LOGIN_URL)
+    try:
+        run_with_adaptive_timeout("navegacao", lambda timeout_ms: page.goto(LOGIN_URL, timeout=timeout_ms))
+    except PlaywrightTimeoutError:
+        raise SEITimeoutError("O SEI não respondeu ao abrir a página de login.")
     
     user_field = wait_for_element(page, "#txtUsuario")
     if user_field:
@@ -152,26 +678,80 @@ def login(page, username_encrypted, password_encrypted):
         raise Exception("Botão de login não encontrado.")
     
     try:
-        page.wait_for_load_state("networkidle", timeout=20000)
+        run_with_adaptive_timeout("login", lambda timeout_ms: page.wait_for_load_state("networkidle", timeout=timeout_ms))
     except PlaywrightTimeoutError:
-        raise Exception("Login pode não ter sido realizado com sucesso.")
+        raise SEITimeoutError("Login pode não ter sido realizado com sucesso.")
+    # Credenciais recusadas: o SEI continua na tela de login
+    if page.query_selector("#pwdSenha"):
+        raise Exception("Login recusado pelo SEI: verifique usuário e senha.")
 
 def access_process(page, process_number):
     try:
-        search_field = wait_for_element(page, "#txtPesquisaRapida", timeout=40000)
+        search_field = wait_for_element(page, "#txtPesquisaRapida", operation="processo")
         search_field.fill(process_number)
         search_field.press("Enter")
         time.sleep(5)
+    except PlaywrightError:
+        # Conexão recusada/interrompida: falha do SEI, chega intacta ao circuit breaker
+        raise
     except Exception as e:
         raise Exception(f"Erro ao acessar o processo: {e}")
 
 IFRAME_VISUALIZACAO_ID = "ifrVisualizacao"
 BUTTON_XPATH_GERAR_PDF = '//*[@id="divArvoreAcoes"]/a[7]/img'
 BUTTON_XPATH_DOWNLOAD_OPTION = '//*[@id="divInfraBarraComandosSuperior"]/button[1]'
+# Linhas de documento (com checkbox) da tabela da tela "Gerar PDF"; ignora o cabeçalho
+DOCUMENT_ROWS_SELECTOR = '#tblDocumentos tr:has(td input[type="checkbox"])'
+
+# Tipos de documento mantidos no download seletivo (regex, sem diferenciar maiúsculas)
+DEFAULT_DOCUMENT_PATTERNS = (
+    r"\bAR\b|Aviso de Recebimento",
+    r"\bAIS\b|Auto de Infra[cç][aã]o",
+    r"Decis[aã]o",
+    r"Identifica[cç][aã]o",
+)
+
+def select_documents(frame, patterns):
+    """
+    Na tela "Gerar PDF", deixa marcados apenas os documentos cuja descrição
+    (tipo e número na árvore do processo) casa com algum dos padrões.
+    Retorna as descrições selecionadas. Se nenhum documento casar, a seleção
+    não é alterada e o PDF sai com o processo inteiro.
+    - Espera as linhas da tabela aparecerem (SEI lento) antes de lê-las; sem
+      nenhuma linha no tempo limite, levanta SEIElementNotFoundError.
+    """
+    compiled = [re.compile(pattern, re.IGNORECASE) for pattern in patterns]
+    wait_for_element(frame, DOCUMENT_ROWS_SELECTOR, operation="gerar_pdf")
+    documents = []
+    for row in frame.query_selector_all(DOCUMENT_ROWS_SELECTOR):
+        checkbox = row.query_selector('input[type="checkbox"]')
+        description = " ".join(row.inner_text().split())
+        keep = any(pattern.search(description) for pattern in compiled)
+        documents.append((checkbox, description, keep))
+
+    selected = [description for _, description, keep in documents if keep]
+    if not selected:
+        logging.warning(
+            f"Nenhum dos {len(documents)} documentos casou com os tipos configurados "
+            f"({len(patterns)} padrão(ões)); gerando o PDF do processo inteiro."
+        )
+        return []
+
+    for checkbox, _, keep in documents:
+        if keep and not checkbox.is_checked():
+            checkbox.check()
+        elif not keep and checkbox.is_checked():
+            checkbox.uncheck()
+    logging.info(f"Download seletivo: {len(selected)} de {len(documents)} documentos.")
+    return selected
 
-def generate_and_download_pdf(page, download_dir):
+def generate_and_download_pdf(page, download_dir, document_patterns=None):
+    """
+    Gera e baixa o PDF do processo. Com document_patterns, baixa só os documentos
+    cujo tipo casa com os padrões (ver select_documents).
+    """
     try:
-        iframe_element = page.wait_for_selector(f'iframe#{IFRAME_VISUALIZACAO_ID}', timeout=10000)
+        iframe_element = wait_for_element(page, f'iframe#{IFRAME_VISUALIZACAO_ID}', operation="gerar_pdf")
         if not iframe_element:
             raise Exception(f"Iframe com ID {IFRAME_VISUALIZACAO_ID} não encontrado.")
         
@@ -179,40 +759,87 @@ def generate_and_download_pdf(page, download_dir):
         if not iframe:
             raise Exception("Não foi possível acessar o conteúdo do iframe.")
         
-        gerar_pdf_button = iframe.wait_for_selector(f'xpath={BUTTON_XPATH_GERAR_PDF}', timeout=10000)
+        gerar_pdf_button = wait_for_element(iframe, f'xpath={BUTTON_XPATH_GERAR_PDF}', operation="gerar_pdf")
         if not gerar_pdf_button:
             raise Exception("Botão para gerar PDF não encontrado.")
         gerar_pdf_button.click()
         time.sleep(2)
+
+        if document_patterns:
+            try:
+                select_documents(iframe, document_patterns)
+            except PlaywrightTimeoutError:
+                raise
+            except Exception as e:
+                # Árvore fora do esperado ou sem documentos: segue com o processo inteiro
+                logging.error(f"Download seletivo não aplicado, baixando o processo inteiro: {e}")
         
-        download_option_button = iframe.wait_for_selector(f'xpath={BUTTON_XPATH_DOWNLOAD_OPTION}', timeout=10000)
+        download_option_button = wait_for_element(iframe, f'xpath={BUTTON_XPATH_DOWNLOAD_OPTION}', operation="gerar_pdf")
         if not download_option_button:
             raise Exception("Botão de opção de download não encontrado.")
         
-        with page.expect_download(timeout=60000) as download_info_option:
-            download_option_button.click()
-        download_option = download_info_option.value
+        def click_and_download(timeout_ms):
+            with page.expect_download(timeout=timeout_ms) as download_info_option:
+                download_option_button.click()
+            return download_info_option.value
+
+        download_option = run_with_adaptive_timeout("download", click_and_download)
         download_option_path = handle_download(download_option, download_dir)
         
         return download_option_path
     
-    except PlaywrightTimeoutError:
-        raise Exception("Timeout ao gerar o PDF do processo.")
+    except (PlaywrightTimeoutError, SEITimeoutError):
+        # Só o download (e a seleção de documentos) estouram tempo aqui: as esperas
+        # por elementos levantam SEIElementNotFoundError
+        raise SEITimeoutError("Timeout ao gerar o PDF do processo.")
+    except PlaywrightError:
+        raise
     except Exception as e:
         raise Exception(f"Erro ao gerar o PDF do processo: {e}")
     finally:
         time.sleep(5)
 
-def process_notification(username_encrypted, password_encrypted, process_number, headless=True):
-    download_dir = os.path.join(os.getcwd(), "downloads")
-    playwright, context, page = create_browser_context(headless=headless)
+def process_notification(credential_token, process_number, headless=True, vault=None, document_patterns=None,
+                         session_id=None, on_wait=None):
+    """
+    Baixa o PDF do processo com o perfil de navegador da sessão (session_id),
+    aguardando vaga no pool de navegadores; on_wait recebe a posição na fila.
+    """
+    # Decifra uma vez por lease, não a cada login
+    credentials = (vault or get_credential_vault()).lease(credential_token)
+    # Com o circuito aberto, falha na hora sem abrir o navegador
+    breaker = get_circuit_breaker()
+    breaker.before_call()
+
+    pool = get_browser_pool()
+    pool.cleanup_stale_profiles()
+    try:
+        with pool.slot(session_id or default_browser_session_id(), on_wait=on_wait) as (user_data_dir, download_dir):
+            return _download_process_pdf(
+                credentials, process_number, headless, document_patterns, breaker, user_data_dir, download_dir
+            )
+    except BaseException:
+        # Garante que uma requisição de teste do circuito não fique presa
+        breaker.release()
+        raise
+
+def _download_process_pdf(credentials, process_number, headless, document_patterns, breaker, user_data_dir, download_dir):
+    playwright, context, page = create_browser_context(
+        headless=headless, user_data_dir=user_data_dir, download_dir=download_dir
+    )
     
     try:
-        login(page, username_encrypted, password_encrypted)
+        login(page, credentials)
         access_process(page, process_number)
-        download_path = generate_and_download_pdf(page, download_dir)
+        download_path = generate_and_download_pdf(page, download_dir, document_patterns=document_patterns)
+        breaker.record_success()
         return download_path
+    except SEI_FAILURE_ERRORS as e:
+        breaker.record_failure()
+        logging.error(f"Erro durante o processamento: {e}")
+        raise e
     except Exception as e:
+        breaker.release()
         logging.error(f"Erro durante o processamento: {e}")
         raise e
     finally:
@@ -222,6 +849,60 @@ def process_notification(username_encrypted, password_encrypted, process_number,
 ###############################################################################
 # Extração de texto e OCR (atualizado)
 ###############################################################################
+# Parâmetros de extração que influenciam o resultado (fazem parte da chave do cache)
+DEFAULT_EXTRACTION_SETTINGS = {
+    "dpi": 300,
+    "psm_mode": 6,
+    "oem_mode": 3,
+    "lang": "por",
+    # Pré-processamento: 'sauvola' (adaptativo), 'otsu' ou 'pil' (limiar fixo original)
+    "preprocess": "sauvola",
+    "deskew": False,
+    "crop_borders": False,
+    # Triagem: OCR completo apenas nas páginas com pistas de AR/AIS/Endereço/CNPJ
+    "triage": False,
+    "triage_dpi": 100,
+    # Motor de OCR: 'pytesseract', 'lote' ou 'tesserocr' (ver OCR_BACKENDS)
+    "ocr_backend": "pytesseract",
+    "ocr_batch_size": 8,
+    # Parada antecipada: percorre páginas por prioridade até achar os campos exigidos
+    "early_exit": False,
+    "early_exit_confidence": 0.8,
+    # NER em blocos via nlp.pipe; ner_processes > 1 usa vários núcleos no NER do texto
+    # inteiro (etapa 'ner' do lote). A extração página a página usa sempre um processo.
+    "ner_batch_size": 32,
+    "ner_processes": 1,
+    "ner_relevant_pages_only": False,
+    # Download seletivo: só documentos cujo tipo casa com document_patterns
+    "selective_download": False,
+    "document_patterns": DEFAULT_DOCUMENT_PATTERNS,
+    # Reprocessamento incremental: páginas já vistas (mesmo hash) não são extraídas de novo
+    "incremental_pages": True,
+    # OCR adaptativo: primeira passada em adaptive_low_dpi; páginas ou trechos com
+    # confiança média abaixo de adaptive_min_confidence (0-100) são refeitos em 'dpi'
+    "adaptive_dpi": False,
+    "adaptive_low_dpi": 150,
+    "adaptive_min_confidence": 70,
+}
+
+def resolve_extraction_settings(settings=None):
+    """
+    Completa as configurações informadas com os valores padrão.
+    """
+    resolved = dict(DEFAULT_EXTRACTION_SETTINGS)
+    if settings:
+        resolved.update(settings)
+    # Lista → tupla, para a configuração continuar utilizável na chave do cache
+    resolved["document_patterns"] = tuple(resolved["document_patterns"])
+    return resolved
+
+def document_patterns_for(settings):
+    """
+    Padrões de tipo de documento a aplicar no download, ou None para o processo inteiro.
+    """
+    settings = resolve_extraction_settings(settings)
+    return settings["document_patterns"] if settings["selective_download"] else None
+
 def normalize_text(text):
     if not isinstance(text, str):
         return text
@@ -252,138 +933,629 @@ def corrigir_texto(texto):
         texto = texto.replace(errado, correto)
     return texto
 
-def extract_text_with_pypdf2(pdf_path):
+###############################################################################
+# Motores de OCR (Tesseract)
+###############################################################################
+# 'pytesseract': um processo tesseract por página (comportamento original).
+# 'lote': um único processo tesseract para uma lista de páginas (carrega o
+#         traineddata uma vez por lote).
+# 'tesserocr': API do Tesseract mantida carregada em memória, uma por thread
+#              (requer o pacote opcional tesserocr).
+OCR_BACKENDS = ("pytesseract", "lote", "tesserocr")
+
+_tesserocr_local = threading.local()
+
+def tesseract_config(lang='por', psm_mode=6, oem_mode=3):
+    return f"--psm {psm_mode} --oem {oem_mode} -l {lang}"
+
+def _get_tesserocr_api(lang, psm_mode, oem_mode):
+    """
+    Retorna a API do Tesseract da thread atual, criando-a apenas na primeira chamada.
+    """
+    apis = getattr(_tesserocr_local, "apis", None)
+    if apis is None:
+        apis = _tesserocr_local.apis = {}
+    key = (lang, psm_mode, oem_mode)
+    if key not in apis:
+        apis[key] = tesserocr.PyTessBaseAPI(lang=lang, psm=psm_mode, oem=oem_mode)
+    return apis[key]
+
+def _ocr_images_tesserocr(images, lang, psm_mode, oem_mode):
+    api = _get_tesserocr_api(lang, psm_mode, oem_mode)
+    texts = []
+    for image in images:
+        api.SetImage(image)
+        texts.append(api.GetUTF8Text())
+    return texts
+
+def _ocr_images_batch(images, lang, psm_mode, oem_mode):
     """
-    Primeiro tenta extrair texto via PyPDF2, sem OCR.
-    Se der certo, retorna o texto.
-    Caso não encontre nada, retorna string vazia.
+    Executa o tesseract uma única vez sobre uma lista de imagens.
+    A saída traz o texto de cada imagem separado por form feed (\\f).
     """
+    with tempfile.TemporaryDirectory(prefix="ocr_lote_") as temp_dir:
+        image_paths = []
+        for idx, image in enumerate(images):
+            image_path = os.path.join(temp_dir, f"pagina_{idx:05d}.png")
+            image.save(image_path, "PNG")
+            image_paths.append(image_path)
+
+        list_path = os.path.join(temp_dir, "paginas.txt")
+        with open(list_path, "w", encoding="utf-8") as list_file:
+            list_file.write("\n".join(image_paths) + "\n")
+
+        result = subprocess.run(
+            [
+                pytesseract.pytesseract.tesseract_cmd, list_path, "stdout",
+                "--psm", str(psm_mode), "--oem", str(oem_mode), "-l", lang,
+            ],
+            capture_output=True,
+            check=True
+        )
+
+    texts = result.stdout.decode("utf-8", errors="replace").split("\f")
+    # O separador também vem após a última página
+    if len(texts) == len(images) + 1 and not texts[-1].strip():
+        texts = texts[:-1]
+    if len(texts) != len(images):
+        raise Exception(f"OCR em lote retornou {len(texts)} páginas para {len(images)} imagens.")
+    return texts
+
+def ocr_images(images, lang='por', psm_mode=6, oem_mode=3, backend="pytesseract"):
+    """
+    Aplica OCR em uma lista de imagens PIL e retorna a lista de textos (mesma ordem).
+    Se o motor escolhido falhar ou não estiver disponível, usa o pytesseract.
+    """
+    if not images:
+        return []
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text
-        
-        if text.strip():
-            text = corrigir_texto(normalize_text(text))
-            return text.strip()
-        else:
-            return ''
-    except:
-        return ''
+        if backend == "tesserocr":
+            if tesserocr is None:
+                raise Exception("pacote tesserocr não instalado")
+            return _ocr_images_tesserocr(images, lang, psm_mode, oem_mode)
+        if backend == "lote":
+            return _ocr_images_batch(images, lang, psm_mode, oem_mode)
+    except Exception as e:
+        logging.error(f"Motor de OCR '{backend}' falhou, usando pytesseract: {e}")
+
+    custom_config = tesseract_config(lang, psm_mode, oem_mode)
+    return [pytesseract.image_to_string(image, config=custom_config) for image in images]
 
-def extract_text_with_context(image_path, file_origin, lang='por'):
+def extract_addresses_from_ocr_text(text_page, file_origin):
     """
-    Extrai texto de uma imagem com Tesseract e localiza endereços básicos via regex.
+    Localiza endereços no texto de uma página (ver parse_address_records).
     - Filtra endereços com menos de 15 caracteres (campo 'endereco').
     - Adiciona 'file_origin' em cada endereço apenas como referência/visão do usuário.
     """
-    try:
-        custom_config = f"--psm 6 --oem 3 -l {lang}"
-        image = Image.open(image_path)
-        text_page = pytesseract.image_to_string(image, config=custom_config)
-
-        text_page = corrigir_texto(normalize_text(text_page))
-
-        # Regex simples para capturar Endereco, Cidade, Bairro, Estado e CEP
-        endereco_pattern = r"Endere[c|ç]o[:\s]+([\w\s.,/\-ºª]+)"
-        cidade_pattern   = r"Cidade[:\s]+([\w\s]+)"
-        bairro_pattern   = r"Bairro[:\s]+([\w\s]+)"
-        estado_pattern   = r"Estado[:\s]+([A-Z]{2})"
-        cep_pattern      = r"CEP[:\s]+([\d.\-]+)"
-
-        enderecos_encontrados = []
-
-        end_matches = re.findall(endereco_pattern, text_page, flags=re.IGNORECASE)
-        cid_matches = re.findall(cidade_pattern, text_page, flags=re.IGNORECASE)
-        bai_matches = re.findall(bairro_pattern, text_page, flags=re.IGNORECASE)
-        uf_matches  = re.findall(estado_pattern, text_page, flags=re.IGNORECASE)
-        cep_matches = re.findall(cep_pattern, text_page, flags=re.IGNORECASE)
-
-        max_len = max(len(end_matches), len(cid_matches), len(bai_matches), len(uf_matches), len(cep_matches))
-
-        for i in range(max_len):
-            endereco_val = end_matches[i] if i < len(end_matches) else "[Não informado]"
-            cidade_val   = cid_matches[i] if i < len(cid_matches) else "[Não informado]"
-            bairro_val   = bai_matches[i] if i < len(bai_matches) else "[Não informado]"
-            estado_val   = uf_matches[i]  if i < len(uf_matches)  else "[Não informado]"
-            cep_val      = cep_matches[i] if i < len(cep_matches) else "[Não informado]"
-
-            # Excluir endereços com menos de 15 caracteres
-            if len(endereco_val.strip()) < 15:
-                continue
+    return parse_address_records(text_page, file_origin)
 
-            enderecos_encontrados.append({
-                "endereco": endereco_val,
-                "cidade": cidade_val,
-                "bairro": bairro_val,
-                "estado": estado_val,
-                "cep": cep_val,
-                "source": file_origin  # apenas exibição em tela
-            })
+###############################################################################
+# Pré-processamento de imagem para OCR (NumPy)
+###############################################################################
+def preprocess_page_pil(page):
+    """
+    Cadeia original em PIL: contraste, limiar global fixo (128) e filtro de mediana.
+    Mantida para comparação e como alternativa ('pil').
+    """
+    gray = page.convert('L')
+    enhancer = ImageEnhance.Contrast(gray)
+    gray = enhancer.enhance(2.0)
+    threshold = gray.point(lambda x: 0 if x < 128 else 255, '1')
+    return threshold.filter(ImageFilter.MedianFilter())
 
-        return text_page, enderecos_encontrados
+def otsu_threshold(gray):
+    """
+    Calcula o limiar global de Otsu a partir do histograma (array uint8).
+    """
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = gray.size
+    if total == 0:
+        return 128
+    weight_bg = np.cumsum(hist)
+    weight_fg = total - weight_bg
+    cum_mean = np.cumsum(hist * np.arange(256))
+    mean_total = cum_mean[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_bg = cum_mean / weight_bg
+        mean_fg = (mean_total - cum_mean) / weight_fg
+        between = weight_bg * weight_fg * (mean_bg - mean_fg) ** 2
+    between = np.nan_to_num(between)
+    return int(np.argmax(between))
+
+def _window_mean(values, window):
+    """
+    Média de cada janela window x window (bordas refletidas) via imagem integral.
+    Usa apenas fatias do array, sem laços em Python.
+    """
+    half_window = window // 2
+    padded = np.pad(values, half_window + 1, mode='reflect')
+    integral = padded.cumsum(axis=0).cumsum(axis=1)
+    height, width = values.shape
+    sums = (
+        integral[window:window + height, window:window + width]
+        - integral[:height, window:window + width]
+        - integral[window:window + height, :width]
+        + integral[:height, :width]
+    )
+    return sums / float(window * window)
 
-    except Exception as e:
-        logging.error(f"Erro ao processar a imagem {image_path}: {e}")
-        return "", []
+def sauvola_threshold(gray, window=31, k=0.1, r=128.0):
+    """
+    Limiar local de Sauvola: T = m * (1 + k * (s / r - 1)),
+    com média (m) e desvio (s) por janela calculados via imagens integrais.
+    Preserva texto fraco (ex.: carimbos do AR) que o limiar global apaga.
+    k menor que o 0.2 da literatura: os carimbos têm pouco contraste com o fundo.
+    """
+    values = gray.astype(np.float64)
+    window = max(window | 1, 3)  # janela ímpar, centrada no pixel
+    mean = _window_mean(values, window)
+    variance = _window_mean(values * values, window) - mean * mean
+    std = np.sqrt(np.clip(variance, 0, None))
+    return mean * (1 + k * (std / r - 1))
+
+def crop_borders(binary, margin=10, min_ink_ratio=0.002):
+    """
+    Remove bordas vazias ou tarjas escuras de digitalização (array booleano, True = tinta).
+    """
+    height, width = binary.shape
+    row_ink = binary.mean(axis=1)
+    col_ink = binary.mean(axis=0)
+    # Linhas/colunas quase totalmente pretas são bordas do scanner, não conteúdo
+    rows = np.where((row_ink > min_ink_ratio) & (row_ink < 0.9))[0]
+    cols = np.where((col_ink > min_ink_ratio) & (col_ink < 0.9))[0]
+    if rows.size == 0 or cols.size == 0:
+        return binary
+    top = max(rows[0] - margin, 0)
+    bottom = min(rows[-1] + margin + 1, height)
+    left = max(cols[0] - margin, 0)
+    right = min(cols[-1] + margin + 1, width)
+    return binary[top:bottom, left:right]
+
+def estimate_skew_angle(binary, max_angle=5.0, step=0.5):
+    """
+    Estima a inclinação da página pelo perfil de projeção horizontal:
+    o ângulo correto maximiza a variância da soma de tinta por linha.
+    Calculado sobre uma versão reduzida da página para ser barato.
+    """
+    ink = Image.fromarray((binary * 255).astype(np.uint8))
+    scale = min(1.0, 800.0 / max(ink.size))
+    if scale < 1.0:
+        ink = ink.resize((max(int(ink.width * scale), 1), max(int(ink.height * scale), 1)), Image.BILINEAR)
+
+    best_angle = 0.0
+    best_score = -1.0
+    for angle in np.arange(-max_angle, max_angle + step / 2, step):
+        rotated = np.asarray(ink.rotate(float(angle), resample=Image.NEAREST, fillcolor=0), dtype=np.float64)
+        score = rotated.sum(axis=1).var()
+        if score > best_score:
+            best_score = score
+            best_angle = float(angle)
+    return best_angle
+
+def preprocess_page_array(page, method="sauvola", deskew=False, crop=False, window=31, k=0.1):
+    """
+    Pré-processamento vetorizado em NumPy.
+    - method: 'sauvola' (limiar adaptativo local) ou 'otsu' (limiar global automático).
+    - deskew: corrige a inclinação da página.
+    - crop: remove bordas vazias/escuras.
+    Retorna uma imagem PIL binária (modo 'L', texto preto em fundo branco).
+    """
+    gray = np.asarray(page.convert('L'), dtype=np.uint8)
+
+    if method == "otsu":
+        binary = gray < otsu_threshold(gray)
+    else:
+        binary = gray < sauvola_threshold(gray, window=window, k=k)
+
+    if deskew:
+        angle = estimate_skew_angle(binary)
+        if angle:
+            rotated = Image.fromarray((binary * 255).astype(np.uint8)).rotate(
+                angle, resample=Image.NEAREST, expand=True, fillcolor=0
+            )
+            binary = np.asarray(rotated) > 127
+
+    if crop:
+        binary = crop_borders(binary)
+
+    result = Image.fromarray(np.where(binary, 0, 255).astype(np.uint8), mode='L')
+    # Remove pontos isolados de ruído deixados pelo limiar local
+    return result.filter(ImageFilter.MedianFilter(3))
+
+def preprocess_page(page, settings=None, dpi=None):
+    """
+    Aplica o pré-processamento definido nas configurações de extração.
+    - dpi: resolução da imagem, quando difere de settings['dpi']; a janela do
+      limiar adaptativo acompanha a escala (31 px valem para 300 dpi).
+    """
+    settings = resolve_extraction_settings(settings)
+    if settings["preprocess"] == "pil":
+        return preprocess_page_pil(page)
+    window = 31
+    if dpi:
+        window = max(15, int(31 * dpi / 300) | 1)
+    return preprocess_page_array(
+        page,
+        method=settings["preprocess"],
+        deskew=settings["deskew"],
+        crop=settings["crop_borders"],
+        window=window
+    )
+
+def rasterize_pages(pdf_path, dpi=300, pages=None, grayscale=False):
+    """
+    Converte páginas do PDF em imagens, gerando (número_da_página, imagem).
+    - pages: lista de páginas (1-based); se None, converte todas.
+    """
+    if pages is None:
+        images = convert_from_path(pdf_path, dpi=dpi, fmt='jpeg', grayscale=grayscale)
+        for idx, image in enumerate(images, start=1):
+            yield idx, image
+        return
+
+    for idx in pages:
+        images = convert_from_path(
+            pdf_path, dpi=dpi, fmt='jpeg', grayscale=grayscale, first_page=idx, last_page=idx
+        )
+        if images:
+            yield idx, images[0]
+
+###############################################################################
+# OCR com resolução adaptativa (confiança por palavra)
+###############################################################################
+ADAPTIVE_REGION_PADDING = 8  # px, na resolução baixa
+# Acima desta fração de palavras com baixa confiança, refaz a página inteira
+ADAPTIVE_FULL_PAGE_RATIO = 0.5
+
+def ocr_words(image, lang='por', psm_mode=6, oem_mode=3):
+    """
+    Palavras reconhecidas com confiança (0-100) e posição, via image_to_data,
+    na ordem de leitura: [{'text', 'conf', 'paragraph', 'line', 'box'}].
+    """
+    data = pytesseract.image_to_data(
+        image, config=tesseract_config(lang, psm_mode, oem_mode), output_type=pytesseract.Output.DICT
+    )
+    words = []
+    for i, word in enumerate(data["text"]):
+        conf = float(data["conf"][i])
+        if conf < 0 or not word.strip():
+            continue
+        paragraph = (data["block_num"][i], data["par_num"][i])
+        words.append({
+            "text": word,
+            "conf": conf,
+            "paragraph": paragraph,
+            "line": paragraph + (data["line_num"][i],),
+            "box": (data["left"][i], data["top"][i], data["width"][i], data["height"][i]),
+        })
+    return words
+
+def words_to_text(words):
+    lines = []
+    current_line = None
+    for word in words:
+        if word["line"] != current_line:
+            lines.append([])
+            current_line = word["line"]
+        lines[-1].append(word["text"])
+    return "\n".join(" ".join(line) for line in lines)
+
+def mean_confidence(words):
+    return float(np.mean([word["conf"] for word in words])) if words else 0.0
+
+def _paragraph_box(words, scale, padding, size):
+    left = min(w["box"][0] for w in words) - padding
+    top = min(w["box"][1] for w in words) - padding
+    right = max(w["box"][0] + w["box"][2] for w in words) + padding
+    bottom = max(w["box"][1] + w["box"][3] for w in words) + padding
+    width, height = size
+    return (
+        max(int(left * scale), 0),
+        max(int(top * scale), 0),
+        min(int(right * scale), width),
+        min(int(bottom * scale), height),
+    )
+
+def ocr_page_adaptive(low_image, settings, rasterize_high):
+    """
+    OCR de uma página em resolução adaptativa.
+    - low_image: página rasterizada em settings['adaptive_low_dpi'].
+    - rasterize_high: função sem argumentos que devolve a página em settings['dpi'];
+      só é chamada quando a confiança baixa exige uma segunda passada.
+    Retorna (texto, qualidade) com qualidade = {'dpi', 'confidence', 'final_confidence',
+    'regions', 'region_dpi'}: com confiança suficiente fica tudo em baixa resolução;
+    com poucos trechos ruins, só esses parágrafos são refeitos em alta; com muitos
+    (ou com deskew/corte de bordas, que mudam a geometria), a página inteira.
+    """
+    settings = resolve_extraction_settings(settings)
+    low_dpi = settings["adaptive_low_dpi"]
+    high_dpi = settings["dpi"]
+    threshold = settings["adaptive_min_confidence"]
+    ocr_args = (settings["lang"], settings["psm_mode"], settings["oem_mode"])
+
+    words = ocr_words(preprocess_page(low_image, settings, dpi=low_dpi), *ocr_args)
+    confidence = mean_confidence(words)
+    quality = {"dpi": low_dpi, "confidence": round(confidence, 1), "final_confidence": round(confidence, 1),
+               "regions": 0, "region_dpi": None}
+    if words and confidence >= threshold:
+        return words_to_text(words), quality
+
+    low_words = [word for word in words if word["conf"] < threshold]
+    high_image = rasterize_high()
+    full_page = (
+        not words
+        or len(low_words) / len(words) > ADAPTIVE_FULL_PAGE_RATIO
+        or settings["deskew"]
+        or settings["crop_borders"]
+    )
+    if full_page:
+        high_words = ocr_words(preprocess_page(high_image, settings, dpi=high_dpi), *ocr_args)
+        quality.update(dpi=high_dpi, final_confidence=round(mean_confidence(high_words), 1))
+        return words_to_text(high_words), quality
+
+    # Só os parágrafos com palavras de baixa confiança voltam ao OCR em alta resolução
+    scale = high_dpi / low_dpi
+    region_settings = dict(settings, deskew=False, crop_borders=False)
+    paragraphs = {}
+    for word in words:
+        paragraphs.setdefault(word["paragraph"], []).append(word)
+    weak_paragraphs = {word["paragraph"] for word in low_words}
+
+    final_words = []
+    for paragraph, paragraph_words in paragraphs.items():
+        if paragraph in weak_paragraphs:
+            box = _paragraph_box(paragraph_words, scale, ADAPTIVE_REGION_PADDING, high_image.size)
+            region = preprocess_page(high_image.crop(box), region_settings, dpi=high_dpi)
+            region_words = ocr_words(region, *ocr_args)
+            quality["regions"] += 1
+            if region_words and mean_confidence(region_words) > mean_confidence(paragraph_words):
+                # Linhas da região não se confundem com as da página
+                paragraph_words = [dict(word, line=("regiao",) + paragraph + word["line"]) for word in region_words]
+        final_words.extend(paragraph_words)
+
+    quality.update(region_dpi=high_dpi, final_confidence=round(mean_confidence(final_words), 1))
+    return words_to_text(final_words), quality
+
+def iter_ocr_adaptive(pdf_path, page_numbers, settings):
+    """
+    Gera (página, texto, qualidade) com ocr_page_adaptive para as páginas indicadas.
+    """
+    settings = resolve_extraction_settings(settings)
+    for idx, low_image in rasterize_pages(pdf_path, dpi=settings["adaptive_low_dpi"], pages=page_numbers):
+        text, quality = ocr_page_adaptive(
+            low_image,
+            settings,
+            lambda idx=idx: next(rasterize_pages(pdf_path, dpi=settings["dpi"], pages=[idx]))[1]
+        )
+        quality["page"] = idx
+        yield idx, text, quality
 
-def ocr_extract(pdf_path, psm_mode=6, oem_mode=3):
+def ocr_extract(pdf_path, psm_mode=6, oem_mode=3, dpi=300, lang='por', settings=None, pages=None):
     """
     Extrai texto via OCR de cada página do PDF (convertida em imagem).
     Retorna todo o texto concatenado e também uma lista de endereços
     encontrados por regex, com respectivo 'source'.
+    - pages: restringe o OCR a essas páginas (1-based), ex.: resultado da triagem.
     """
     text_total = ""
     enderecos_totais = []
 
-    try:
-        pages = convert_from_path(pdf_path, dpi=300, fmt='jpeg')
-
-        for idx, page in enumerate(pages, start=1):
-            gray = page.convert('L')
-            enhancer = ImageEnhance.Contrast(gray)
-            gray = enhancer.enhance(2.0)
-            threshold = gray.point(lambda x: 0 if x < 128 else 255, '1')
-            threshold = threshold.filter(ImageFilter.MedianFilter())
-
-            temp_filename = f"temp_page_{idx}.jpg"
-            threshold.save(temp_filename, "JPEG")
-
+    def ocr_batch(batch):
+        # Um lote de páginas já pré-processadas vai de uma vez ao motor de OCR
+        texts = ocr_images(
+            [image for _, image in batch],
+            lang=lang,
+            psm_mode=psm_mode,
+            oem_mode=oem_mode,
+            backend=settings["ocr_backend"]
+        )
+        results = []
+        for (idx, _), text_page in zip(batch, texts):
+            text_page = corrigir_texto(normalize_text(text_page))
             file_origin = f"{os.path.basename(pdf_path)} - Página {idx}"
-            text_page, enderecos_page = extract_text_with_context(temp_filename, file_origin, lang='por')
+            results.append((text_page, extract_addresses_from_ocr_text(text_page, file_origin)))
+        return results
+
+    settings = resolve_extraction_settings(settings)
+    if settings["adaptive_dpi"]:
+        try:
+            page_numbers = pages or range(1, len(PdfReader(pdf_path).pages) + 1)
+            adaptive_settings = dict(settings, dpi=dpi, lang=lang, psm_mode=psm_mode, oem_mode=oem_mode)
+            for idx, text_page, _ in iter_ocr_adaptive(pdf_path, page_numbers, adaptive_settings):
+                text_page = corrigir_texto(normalize_text(text_page))
+                text_total += text_page + "\n"
+                file_origin = f"{os.path.basename(pdf_path)} - Página {idx}"
+                enderecos_totais.extend(extract_addresses_from_ocr_text(text_page, file_origin))
+        except Exception as e:
+            st.error(f"Erro durante o OCR: {e}")
+        return corrigir_texto(normalize_text(text_total)), enderecos_totais
+
+    batch = []
+    try:
+        for idx, page in rasterize_pages(pdf_path, dpi=dpi, pages=pages):
+            batch.append((idx, preprocess_page(page, settings)))
+            if len(batch) < settings["ocr_batch_size"]:
+                continue
+            for text_page, enderecos_page in ocr_batch(batch):
+                text_total += text_page + "\n"
+                enderecos_totais.extend(enderecos_page)
+            batch = []
 
+        for text_page, enderecos_page in ocr_batch(batch):
             text_total += text_page + "\n"
             enderecos_totais.extend(enderecos_page)
 
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-
     except Exception as e:
         st.error(f"Erro durante o OCR: {e}")
 
     text_total = corrigir_texto(normalize_text(text_total))
     return text_total, enderecos_totais
 
-def extract_text_with_best_ocr(pdf_path):
+###############################################################################
+# Extração página a página (streaming)
+###############################################################################
+def _ocr_page_records(pdf_path, page_numbers, settings):
     """
-    Tenta extrair texto sem OCR (PyPDF2).
-    Se não conseguir, faz OCR em cada página.
-    Retorna o texto final e a lista de endereços extraídos (com .source).
+    Rasteriza e aplica OCR num pequeno lote de páginas, gerando um registro por página.
+    No modo adaptativo, o registro traz também 'ocr_quality' (DPI e confiança).
     """
-    extracted_text = extract_text_with_pypdf2(pdf_path)
-    if extracted_text.strip():
-        # Se extraiu com PyPDF2, não faz OCR
-        return extracted_text, []
-    
-    # Caso contrário, faz OCR
-    text_ocr, enderecos_ocr = ocr_extract(pdf_path, psm_mode=6, oem_mode=3)
-    if len(text_ocr) > 0:
-        return text_ocr, enderecos_ocr
+    if settings["adaptive_dpi"]:
+        start = time.perf_counter()
+        for idx, text, quality in iter_ocr_adaptive(pdf_path, page_numbers, settings):
+            seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            yield {"page": idx, "text": corrigir_texto(normalize_text(text)), "origin": "ocr",
+                   "seconds": seconds, "ocr_quality": quality}
+        return
+
+    start = time.perf_counter()
+    images = []
+    for idx, image in rasterize_pages(pdf_path, dpi=settings["dpi"], pages=page_numbers):
+        images.append((idx, preprocess_page(image, settings)))
+    texts = ocr_images(
+        [image for _, image in images],
+        lang=settings["lang"],
+        psm_mode=settings["psm_mode"],
+        oem_mode=settings["oem_mode"],
+        backend=settings["ocr_backend"]
+    )
+    # Tempo do lote dividido igualmente entre as páginas
+    seconds = (time.perf_counter() - start) / max(len(images), 1)
+    for (idx, _), text in zip(images, texts):
+        yield {"page": idx, "text": corrigir_texto(normalize_text(text)), "origin": "ocr", "seconds": seconds}
+
+def iter_pdf_pages(pdf_path, settings=None, pages=None, ocr=True, ocr_pages=None):
+    """
+    Gera um registro por página, na ordem de `pages` (padrão: todas):
+    {'page', 'text', 'origin' ('texto' ou 'ocr'), 'seconds', 'total_pages'}; páginas de
+    texto trazem também 'ocr_skipped' (camada de texto vazia, mas OCR não feito).
+    - Usa a camada de texto quando existe; senão faz OCR da página (se ocr=True
+      e, havendo ocr_pages, apenas para as páginas listadas).
+    - Páginas digitalizadas consecutivas são agrupadas em lotes de ocr_batch_size,
+      de modo que a memória fica limitada a um lote, qualquer que seja o tamanho do PDF.
+    """
+    settings = resolve_extraction_settings(settings)
+    reader = PdfReader(pdf_path)
+    total_pages = len(reader.pages)
+    page_numbers = list(pages) if pages is not None else range(1, total_pages + 1)
+    pending_ocr = []
+
+    def flush():
+        for record in _ocr_page_records(pdf_path, pending_ocr, settings):
+            record["total_pages"] = total_pages
+            yield record
+        pending_ocr.clear()
+
+    for idx in page_numbers:
+        start = time.perf_counter()
+        try:
+            raw_text = reader.pages[idx - 1].extract_text() or ""
+        except Exception as e:
+            logging.error(f"Erro ao ler a camada de texto da página {idx}: {e}")
+            raw_text = ""
+
+        needs_ocr = (
+            ocr
+            and len(raw_text.strip()) < MIN_TEXT_LAYER_CHARS
+            and (ocr_pages is None or idx in ocr_pages)
+        )
+        if needs_ocr:
+            pending_ocr.append(idx)
+            if len(pending_ocr) >= settings["ocr_batch_size"]:
+                yield from flush()
+            continue
+
+        # Mantém a ordem: páginas de OCR pendentes saem antes desta
+        if pending_ocr:
+            yield from flush()
+        yield {
+            "page": idx,
+            "text": corrigir_texto(normalize_text(raw_text)),
+            "origin": "texto",
+            "seconds": time.perf_counter() - start,
+            "total_pages": total_pages,
+            # Digitalizada, mas sem OCR (fora de ocr_pages ou ocr=False): texto incompleto
+            "ocr_skipped": len(raw_text.strip()) < MIN_TEXT_LAYER_CHARS,
+        }
+
+    if pending_ocr:
+        yield from flush()
+
+###############################################################################
+# Triagem de páginas (passada barata antes do OCR completo)
+###############################################################################
+# Mesmas pistas procuradas por extract_addresses_with_source, aplicadas ao texto
+# já normalizado (sem acentos).
+PAGE_RELEVANCE_CUES = {
+    "AR": re.compile(r"\bAR\b|Aviso de Recebimento", re.IGNORECASE),
+    "AIS": re.compile(r"\bAIS\b|Auto de Infracao Sanitaria", re.IGNORECASE),
+    "Endereço": re.compile(r"\bEndereco\b|\bEnd\s*:", re.IGNORECASE),
+    "CNPJ": re.compile(r"\bCNPJ\b|\bCPF\b", re.IGNORECASE),
+    "CEP": re.compile(r"\bCEP\b", re.IGNORECASE),
+}
+
+# Abaixo disso a camada de texto é considerada ausente (página digitalizada)
+MIN_TEXT_LAYER_CHARS = 20
+
+def classify_page(text):
+    """
+    Retorna a lista de pistas (AR, AIS, Endereço, CNPJ, CEP) encontradas no texto da página.
+    """
+    text = normalize_text(text or "")
+    return [cue for cue, pattern in PAGE_RELEVANCE_CUES.items() if pattern.search(text)]
 
-    return "", []
+def triage_pages(pdf_path, settings=None):
+    """
+    Primeira passada barata: classifica cada página pela camada de texto, quando existe,
+    ou por OCR em baixa resolução. Retorna (páginas_relevantes, relatório), onde o
+    relatório traz, por página, a origem da classificação e as pistas encontradas.
+    """
+    settings = resolve_extraction_settings(settings)
+    reader = PdfReader(pdf_path)
+    relevant_pages = []
+    report = []
+
+    for idx, pdf_page in enumerate(reader.pages, start=1):
+        try:
+            page_text = pdf_page.extract_text() or ""
+        except Exception as e:
+            logging.error(f"Erro ao ler a camada de texto da página {idx}: {e}")
+            page_text = ""
+
+        origin = "texto"
+        if len(page_text.strip()) < MIN_TEXT_LAYER_CHARS:
+            origin = f"ocr {settings['triage_dpi']} dpi"
+            page_text = ""
+            for _, image in rasterize_pages(pdf_path, dpi=settings["triage_dpi"], pages=[idx], grayscale=True):
+                page_text = ocr_images(
+                    [image],
+                    lang=settings["lang"],
+                    psm_mode=settings["psm_mode"],
+                    oem_mode=settings["oem_mode"],
+                    backend=settings["ocr_backend"]
+                )[0]
+
+        cues = classify_page(page_text)
+        if cues:
+            relevant_pages.append(idx)
+        report.append({"page": idx, "origin": origin, "cues": cues})
+
+    return relevant_pages, report
+
+def triaged_ocr_pages(pdf_path, settings):
+    """
+    Páginas a passar por OCR segundo a triagem (settings['triage']), ou None para todas.
+    Sem nenhuma pista, ou com erro na triagem, processa tudo: melhor do que nada.
+    """
+    if not settings["triage"]:
+        return None
+    try:
+        relevant_pages, report = triage_pages(pdf_path, settings)
+        logging.info(f"Triagem: {len(relevant_pages)} de {len(report)} páginas relevantes: {relevant_pages}")
+        return set(relevant_pages) or None
+    except Exception as e:
+        logging.error(f"Erro na triagem de páginas, processando todas: {e}")
+        return None
 
 ###############################################################################
 # Formatação e extração de dados
@@ -410,26 +1582,114 @@ def extract_process_number(file_name):
         return base_name
     return f"{digits[:5]}.{digits[5:11]}/{digits[11:15]}-{digits[14:]}"
 
-def extract_information_spacy(text):
+###############################################################################
+# NER em blocos (nlp.pipe)
+###############################################################################
+# Bem abaixo de nlp.max_length (1.000.000), para limitar a memória por documento
+NER_CHUNK_CHARS = 100_000
+# Componentes necessários às entidades; os demais (parser, lemmatizer...) são desligados
+NER_REQUIRED_PIPES = ("tok2vec", "ner")
+NER_LABELS_NOME = ("PER", "ORG")
+
+def iter_page_texts(text):
     """
-    Exemplo de extração com spacy (nomes, e-mails, etc.).
+    Gera (número_da_página, texto) a partir do texto com páginas separadas por \\f.
     """
-    doc = nlp(text)
-    info = {
-        "nome_autuado": None,
-        "cpf": None,
-        "cnpj": None,
-        "socios_advogados": [],
-        "emails": [],
-    }
-    
-    for ent in doc.ents:
-        if ent.label_ in ["PER", "ORG"]:
-            if not info["nome_autuado"]:
-                info["nome_autuado"] = ent.text.strip()
-        elif ent.label_ == "EMAIL":
-            info["emails"].append(ent.text.strip())
-    
+    for page_number, page_text in enumerate(text.split("\f"), start=1):
+        yield page_number, page_text
+
+def _split_long_text(text, max_chars):
+    """
+    Divide um texto em blocos de até max_chars, preferindo quebras de parágrafo,
+    depois de linha e, por fim, espaços. Gera (bloco, deslocamento).
+    """
+    start = 0
+    while len(text) - start > max_chars:
+        end = start + max_chars
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, start + max_chars // 2, end)
+            if cut != -1:
+                cut += len(separator)
+                break
+        if cut == -1:
+            cut = end
+        yield text[start:cut], start
+        start = cut
+    if start < len(text):
+        yield text[start:], start
+
+def iter_ner_chunks(pages, max_chars=NER_CHUNK_CHARS, only_pages=None):
+    """
+    Gera (bloco, {'page', 'offset'}) para nlp.pipe(as_tuples=True): uma página por
+    bloco, ou parágrafos quando a página passa de max_chars.
+    - only_pages: conjunto de páginas a analisar (None = todas).
+    """
+    for page_number, page_text in pages:
+        if only_pages is not None and page_number not in only_pages:
+            continue
+        if not page_text.strip():
+            continue
+        for chunk, offset in _split_long_text(page_text, max_chars):
+            yield chunk, {"page": page_number, "offset": offset}
+
+def extract_entities(pages, only_pages=None, batch_size=32, n_process=1, max_chars=NER_CHUNK_CHARS):
+    """
+    Executa o NER sobre (página, texto) em blocos, com nlp.pipe.
+    Retorna as ocorrências na ordem do documento:
+    [{'texto', 'rotulo', 'pagina', 'inicio', 'fim'}], com posições relativas à página.
+    """
+    disabled = [name for name in nlp.pipe_names if name not in NER_REQUIRED_PIPES]
+    docs = nlp.pipe(
+        iter_ner_chunks(pages, max_chars=max_chars, only_pages=only_pages),
+        as_tuples=True,
+        batch_size=batch_size,
+        n_process=n_process,
+        disable=disabled
+    )
+    entities = []
+    for doc, context in docs:
+        for ent in doc.ents:
+            entities.append({
+                "texto": ent.text.strip(),
+                "rotulo": ent.label_,
+                "pagina": context["page"],
+                "inicio": context["offset"] + ent.start_char,
+                "fim": context["offset"] + ent.end_char,
+            })
+    return entities
+
+def aggregate_entities(entities, aggregated=None):
+    """
+    Agrupa ocorrências por (rótulo, texto): [{'texto', 'rotulo', 'paginas', 'ocorrencias'}],
+    na ordem da primeira ocorrência. Se `aggregated` for informado, é atualizado.
+    """
+    aggregated = aggregated if aggregated is not None else []
+    by_key = {(item["rotulo"], item["texto"]): item for item in aggregated}
+    for entity in entities:
+        key = (entity["rotulo"], entity["texto"])
+        item = by_key.get(key)
+        if item is None:
+            item = {"texto": entity["texto"], "rotulo": entity["rotulo"], "paginas": [], "ocorrencias": 0}
+            by_key[key] = item
+            aggregated.append(item)
+        item["ocorrencias"] += 1
+        if entity["pagina"] not in item["paginas"]:
+            item["paginas"].append(entity["pagina"])
+    return aggregated
+
+def relevant_text_pages(text):
+    """
+    Páginas do texto (separado por \\f) com pistas de AR/AIS/Endereço/CNPJ/CEP.
+    """
+    return {page_number for page_number, page_text in iter_page_texts(text) if classify_page(page_text)}
+
+def extract_identifiers(text):
+    """
+    Campos obtidos por regex: CNPJ, CPF (validados) e sócios/advogados.
+    """
+    info = {"cpf": None, "cnpj": None, "socios_advogados": []}
+
     # Regex para CNPJ/CPF
     cnpj_pattern = r"CNPJ:\s*([\d./-]{14,18})"
     cpf_pattern  = r"CPF:\s*([\d./-]{11,14})"
@@ -453,22 +1713,135 @@ def extract_information_spacy(text):
     
     return info
 
+def apply_entities(info, entities):
+    """
+    Preenche nome_autuado (primeira entidade PER/ORG) e e-mails a partir das ocorrências.
+    """
+    for entity in entities:
+        if entity["rotulo"] in NER_LABELS_NOME:
+            if not info["nome_autuado"]:
+                info["nome_autuado"] = entity["texto"]
+        elif entity["rotulo"] == "EMAIL":
+            info["emails"].append(entity["texto"])
+    info["entidades"] = aggregate_entities(entities, info.get("entidades"))
+    return info
+
+def extract_information_spacy(text, only_pages=None, batch_size=32, n_process=1):
+    """
+    Exemplo de extração com spacy (nomes, e-mails, etc.).
+    - O texto é analisado por página (\\f) ou parágrafo, nunca inteiro, o que evita
+      o limite nlp.max_length em processos grandes.
+    - only_pages: restringe o NER a essas páginas (as regexes continuam no texto todo).
+    """
+    info = {
+        "nome_autuado": None,
+        "cpf": None,
+        "cnpj": None,
+        "socios_advogados": [],
+        "emails": [],
+        "entidades": [],
+    }
+    entities = extract_entities(iter_page_texts(text), only_pages=only_pages, batch_size=batch_size, n_process=n_process)
+    apply_entities(info, entities)
+    info.update(extract_identifiers(text))
+    return info
+
+ADDRESS_FIELDS = ("endereco", "cidade", "bairro", "estado", "cep")
+
+# Rótulos de campos de endereço. Todo rótulo precisa de ':' logo depois, senão palavras
+# soltas no texto ("no Estado de São Paulo, na cidade de...") abririam endereços.
+# "Endereço eletrônico" e "Endereço de e-mail" não são endereços postais.
+ADDRESS_LABEL_PATTERN = re.compile(
+    r"(?=[EeBbCcMmUu])"  # descarta rápido as posições que não iniciam um rótulo
+    r"(?<!\w)(?:"
+    r"(?P<endereco>(?:Endere[cç]o|End)(?!\s+(?:eletr[oô]nico|de\s+e-?mail)))"
+    r"|(?P<bairro>Bairro)"
+    r"|(?P<cidade>Cidade|Munic[ií]pio)"
+    r"|(?P<estado>Estado|UF)"
+    r"|(?P<cep>CEP)"
+    r")(?!\w)\s*:\s*",
+    re.IGNORECASE
+)
+EMAIL_VALUE_PATTERN = re.compile(r"\S+@\S+")
+UF_VALUE_PATTERN = re.compile(r"([A-Za-z]{2})(?!\w)")
+CEP_VALUE_PATTERN = re.compile(r"\d{2}\.?\d{3}-?\d{3}")
+
+def _clean_address_value(field, value):
+    value = value.strip(" \t,;-")
+    if field == "estado":
+        match = UF_VALUE_PATTERN.match(value)
+        return match.group(1).upper() if match else ""
+    if field == "cep":
+        match = CEP_VALUE_PATTERN.search(value)
+        return match.group(0) if match else ""
+    if field == "endereco" and EMAIL_VALUE_PATTERN.search(value):
+        return ""
+    return value
+
+def parse_address_records(text, source):
+    """
+    Percorre os rótulos do texto numa única passada, montando cada bloco de
+    endereço como um registro: 'Endereço' abre um novo registro, os demais rótulos
+    (Bairro, Cidade, Estado/UF, CEP) preenchem o registro aberto, e um rótulo já
+    preenchido também abre um novo. Assim, um campo ausente não desloca os campos
+    dos endereços seguintes.
+    - O valor vai do rótulo até o próximo rótulo ou o fim da linha.
+    - Linhas sem rótulo continuam o endereço quando ele termina em vírgula ou hífen.
+    - Filtra endereços com menos de 15 caracteres (campo 'endereco').
+    """
+    records = []
+    current = {}
+
+    def emit():
+        if len(current.get("endereco", "")) < 15:
+            return
+        record = {field: current.get(field) or "[Não informado]" for field in ADDRESS_FIELDS}
+        record["source"] = source
+        records.append(record)
+
+    matches = list(ADDRESS_LABEL_PATTERN.finditer(text))
+    text_length = len(text)
+    for position, match in enumerate(matches):
+        next_start = matches[position + 1].start() if position + 1 < len(matches) else text_length
+        line_end = text.find("\n", match.end())
+        if line_end == -1:
+            line_end = text_length
+
+        field = match.lastgroup
+        raw_value = text[match.end():min(next_start, line_end)]
+        value = _clean_address_value(field, raw_value)
+
+        # Endereço quebrado em várias linhas: junta as linhas seguintes sem rótulo
+        while field == "endereco" and value and next_start > line_end and raw_value.rstrip().endswith((",", "-")):
+            following_end = text.find("\n", line_end + 1)
+            if following_end == -1:
+                following_end = text_length
+            raw_value = text[line_end + 1:min(next_start, following_end)]
+            if not raw_value.strip():
+                break
+            value = f"{value}, {raw_value.strip(' ,;-')}"
+            line_end = following_end
+
+        if not value:
+            continue
+        if current and (field == "endereco" or field in current):
+            emit()
+            current = {}
+        current[field] = value
+
+    if current:
+        emit()
+    return records
+
 def extract_addresses_with_source(text):
     """
     Exemplo: extrai endereços com a 'source' baseada em 'AR' ou 'AIS' no texto.
     + Filtrar endereços < 15 caracteres.
     """
-    doc = nlp(text)
     page_blocks = text.split("\f")
     
     addresses = []
     
-    endereco_pattern = r"(?:Endereço|End|Endereco):\s*([\w\s.,ºª-]+)"
-    cidade_pattern   = r"Cidade:\s*([\w\s]+(?: DE [\w\s]+)?)"
-    bairro_pattern   = r"Bairro:\s*([\w\s]+)"
-    estado_pattern   = r"Estado:\s*([A-Z]{2})"
-    cep_pattern      = r"CEP:\s*(\d{2}\.\d{3}-\d{3}|\d{5}-\d{3})"
-    
     for block in page_blocks:
         block_clean = block.strip()
         block_source = "Desconhecido"
@@ -477,38 +1850,7 @@ def extract_addresses_with_source(text):
         elif re.search(r"\bAIS\b", block_clean, re.IGNORECASE):
             block_source = "AIS"
         
-        endereco_matches = re.findall(endereco_pattern, block_clean, re.IGNORECASE)
-        cidade_matches   = re.findall(cidade_pattern, block_clean, re.IGNORECASE)
-        bairro_matches   = re.findall(bairro_pattern, block_clean, re.IGNORECASE)
-        estado_matches   = re.findall(estado_pattern, block_clean, re.IGNORECASE)
-        cep_matches      = re.findall(cep_pattern, block_clean, re.IGNORECASE)
-        
-        max_len = max(
-            len(endereco_matches),
-            len(cidade_matches),
-            len(bairro_matches),
-            len(estado_matches),
-            len(cep_matches)
-        )
-        
-        for i in range(max_len):
-            end_str = endereco_matches[i].strip() if i < len(endereco_matches) else "[Não informado]"
-            cid_str = cidade_matches[i].strip()   if i < len(cidade_matches)   else "[Não informado]"
-            bai_str = bairro_matches[i].strip()   if i < len(bairro_matches)   else "[Não informado]"
-            uf_str  = estado_matches[i].strip()   if i < len(estado_matches)   else "[Não informado]"
-            cep_str = cep_matches[i].strip()      if i < len(cep_matches)      else "[Não informado]"
-            
-            if len(end_str) < 15:
-                continue
-            
-            addresses.append({
-                "endereco": end_str,
-                "cidade": cid_str,
-                "bairro": bai_str,
-                "estado": uf_str,
-                "cep": cep_str,
-                "source": block_source
-            })
+        addresses.extend(parse_address_records(block_clean, block_source))
     
     return addresses
 
@@ -518,9 +1860,847 @@ def normalize_address(address):
     address = re.sub(r'\s+', ' ', address)
     return address.lower().strip()
 
+# Similaridade mínima (0 a 1) entre endereços normalizados para considerá-los o mesmo
+ADDRESS_SIMILARITY_THRESHOLD = 0.85
+
+# Caracteres iniciais do logradouro normalizado usados como chave de bloco
+ADDRESS_PREFIX_LENGTH = 8
+
+def _address_identity(address):
+    """
+    (CEP com 8 dígitos ou "", UF, números) do endereço. A UF vem do Estado e, sem ele,
+    da faixa do CEP; números são as palavras só de dígitos do logradouro (número do
+    imóvel e complemento: sala, apartamento, bloco), ignorando dígitos que o OCR
+    trocou no meio de palavras ("Fl0res").
+    """
+    numbers = tuple(re.findall(r"\b\d+\b", normalize_address(address.get("endereco") or "")))
+    cep = re.sub(r"\D", "", address.get("cep") or "")
+    if len(cep) != 8:
+        cep = ""
+    uf = (address.get("estado") or "").strip().upper()
+    if not re.fullmatch(r"[A-Z]{2}", uf):
+        uf = uf_for_cep(cep) if cep else None
+    return cep, uf or "", numbers
+
+def _address_block_keys(identity, normalized, lookup=False):
+    """
+    Chaves de bloco. Endereços com números (imóvel/complemento) só podem ser o mesmo
+    que outros com os mesmos números (ver _conflicting_addresses), então ficam no
+    bloco desses números. Os sem números podem ser qualquer imóvel da rua e ficam
+    nos blocos de CEP, UF (do Estado ou da faixa do CEP) e início do logradouro.
+    - Na busca (lookup=True), quem tem números procura no bloco dos seus números e
+      nos blocos amplos dos sem números; quem não tem procura nos blocos amplos de
+      todos. Nos blocos amplos, quem tem CEP não procura no bloco da UF.
+    """
+    cep, uf, numbers = identity
+    broad = []
+    if cep:
+        broad.append(f"cep:{cep}")
+    if uf and not (lookup and cep):
+        broad.append(f"uf:{uf}")
+    if normalized:
+        broad.append(f"prefixo:{normalized[:ADDRESS_PREFIX_LENGTH]}")
+
+    if not lookup:
+        if numbers:
+            return [f"numeros:{' '.join(numbers)}"] + [f"com_numeros:{key}" for key in broad]
+        return [f"sem_numeros:{key}" for key in broad]
+    keys = [f"sem_numeros:{key}" for key in broad]
+    if numbers:
+        return [f"numeros:{' '.join(numbers)}"] + keys
+    return [f"com_numeros:{key}" for key in broad] + keys
+
+def _conflicting_addresses(a, b):
+    """
+    CEPs, UFs ou números (imóvel e complemento) informados e diferentes (identidades
+    de _address_identity): não são o mesmo endereço, por mais parecida que seja a rua.
+    "Rua X, 1200, Sala 4" e "Rua X, 1500, Sala 9" são destinatários distintos.
+    """
+    (cep_a, uf_a, numbers_a), (cep_b, uf_b, numbers_b) = a, b
+    if cep_a and cep_b and cep_a != cep_b:
+        return True
+    if uf_a and uf_b and uf_a != uf_b:
+        return True
+    return bool(numbers_a and numbers_b and numbers_a != numbers_b)
+
+def _conflicting_groups(identities_a, identities_b):
+    # Grupos só se unem se nenhum par de endereços deles conflita (sem união transitiva)
+    return any(_conflicting_addresses(a, b) for a in identities_a for b in identities_b)
+
+def _similar_addresses(a, b, threshold, matcher=None):
+    """
+    Compara dois endereços normalizados, descartando cedo os pares que não podem
+    atingir o limiar (diferença de tamanho e quick_ratio) antes do ratio completo.
+    - matcher: SequenceMatcher já preparado com b (set_seq2), reaproveitado entre
+      comparações do mesmo endereço.
+    """
+    if not a or not b:
+        return False
+    if 2.0 * min(len(a), len(b)) / (len(a) + len(b)) < threshold:
+        return False
+    if matcher is None:
+        matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+    else:
+        matcher.set_seq1(a)
+    return matcher.real_quick_ratio() >= threshold and matcher.quick_ratio() >= threshold and matcher.ratio() >= threshold
+
+def _merge_address(target, address):
+    # Completa campos ausentes e acumula as origens
+    for field in ("endereco", "cidade", "bairro", "estado", "cep"):
+        if target.get(field, "[Não informado]") == "[Não informado]" and address.get(field, "[Não informado]") != "[Não informado]":
+            target[field] = address[field]
+    for source in address.get("sources", [address.get("source", "Desconhecido")]):
+        if source not in target["sources"]:
+            target["sources"].append(source)
+    target["source"] = " | ".join(target["sources"])
+    target["ocorrencias"] += address.get("ocorrencias", 1)
+
+def deduplicate_addresses(addresses, similarity_threshold=ADDRESS_SIMILARITY_THRESHOLD):
+    """
+    Remove endereços repetidos ou quase repetidos (erros de OCR, abreviações).
+    - Normaliza com normalize_address e agrupa pelos números do imóvel ou por CEP, UF e
+      início do logradouro (ver _address_block_keys), evitando comparar todos os pares.
+    - Iguais após normalização são unidos direto (dicionário); os demais são comparados
+      por similaridade com os endereços já mantidos nos blocos em comum. CEP, UF ou
+      números do imóvel/complemento divergentes impedem a união.
+    - Cada endereço mantido guarda as identidades de tudo o que foi unido a ele; um
+      novo endereço só entra se não conflita com nenhuma. Quando casa com vários
+      mantidos, eles são unidos num só apenas se não conflitam entre si.
+    - O endereço mantido guarda todas as origens em 'sources' (e 'source' concatenado)
+      e o número de ocorrências em 'ocorrencias'.
+    """
+    unique = []
+    blocks = {}
+    exact = {}
+    # id do endereço mantido -> identidades de todos os endereços unidos a ele
+    members = {}
+    indexed = set()
+    merged_away = set()
+
+    def index(record, normalized):
+        for key in _address_block_keys(_address_identity(record), normalized):
+            if (key, id(record)) not in indexed:
+                indexed.add((key, id(record)))
+                blocks.setdefault(key, []).append((normalized, record))
+
+    for address in addresses:
+        normalized = normalize_address(address.get("endereco") or "")
+
+        matches = []
+        if normalized:
+            identity = _address_identity(address)
+            exact_match = exact.get(normalized)
+            if exact_match is not None and not _conflicting_groups(members[id(exact_match)], [identity]):
+                matches.append(exact_match)
+            seen = {id(match) for match in matches} | merged_away
+            matcher = difflib.SequenceMatcher(None, autojunk=False)
+            matcher.set_seq2(normalized)
+            for key in _address_block_keys(identity, normalized, lookup=True):
+                for candidate_normalized, candidate in blocks.get(key, []):
+                    if id(candidate) in seen:
+                        continue
+                    seen.add(id(candidate))
+                    if _conflicting_groups(members[id(candidate)], [identity]):
+                        continue
+                    if _similar_addresses(candidate_normalized, normalized, similarity_threshold, matcher):
+                        matches.append(candidate)
+
+        if matches:
+            target = matches[0]
+            _merge_address(target, address)
+            members[id(target)].add(identity)
+            for other in matches[1:]:
+                if not _conflicting_groups(members[id(target)], members[id(other)]):
+                    _merge_address(target, other)
+                    members[id(target)] |= members.pop(id(other))
+                    merged_away.add(id(other))
+                    for key, value in exact.items():
+                        if value is other:
+                            exact[key] = target
+            # Campos completados (ex.: CEP) criam novas chaves de bloco
+            index(target, normalize_address(target.get("endereco") or ""))
+            continue
+
+        record = dict(address)
+        record["sources"] = list(address.get("sources", [address.get("source", "Desconhecido")]))
+        record["source"] = " | ".join(record["sources"])
+        record["ocorrencias"] = address.get("ocorrencias", 1)
+        unique.append(record)
+        if normalized:
+            members[id(record)] = {identity}
+            exact.setdefault(normalized, record)
+            index(record, normalized)
+
+    return [record for record in unique if id(record) not in merged_away]
+
+###############################################################################
+# Índice local de CEP (preenchimento e validação de endereços)
+###############################################################################
+CEP_INDEX_PATH = os.environ.get("ANAVISA_CEP_INDEX", os.path.join(os.getcwd(), "cep_index.bin"))
+
+@st.cache_resource
+def get_cep_index():
+    """
+    Abre o índice de CEP uma vez por servidor. Sem o arquivo, retorna None
+    (apenas a validação CEP/UF por faixa continua disponível).
+    Para gerar: python cep_index.py base_ceps.csv cep_index.bin
+    """
+    if not os.path.exists(CEP_INDEX_PATH):
+        return None
+    try:
+        return CepIndex(CEP_INDEX_PATH)
+    except Exception as e:
+        logging.error(f"Erro ao abrir o índice de CEP {CEP_INDEX_PATH}: {e}")
+        return None
+
+def enrich_addresses_with_cep(addresses, index=None):
+    """
+    Completa Cidade/Bairro/Estado '[Não informado]' a partir do CEP e sinaliza em
+    'alerta_cep' os pares CEP/UF inconsistentes (pelo índice ou pela faixa de CEP da UF).
+    """
+    for address in addresses:
+        cep = address.get("cep", "")
+        if cep_to_int(cep) is None:
+            continue
+
+        entry = index.lookup(cep) if index is not None else None
+        if entry:
+            for field, index_field in (("cidade", "cidade"), ("bairro", "bairro"), ("estado", "uf")):
+                if address.get(field, "[Não informado]") == "[Não informado]" and entry[index_field]:
+                    address[field] = entry[index_field]
+            expected_uf = entry["uf"] or uf_for_cep(cep)
+        else:
+            expected_uf = uf_for_cep(cep)
+
+        informed_uf = (address.get("estado") or "").strip().upper()
+        if expected_uf and re.fullmatch(r"[A-Z]{2}", informed_uf) and informed_uf != expected_uf:
+            address["alerta_cep"] = f"CEP {cep} pertence a {expected_uf}, mas o estado informado é {informed_uf}."
+    return addresses
+
 def extract_all_emails(emails):
     return list(set(emails))
 
+###############################################################################
+# Cache de páginas por hash de conteúdo (reprocessamento incremental)
+###############################################################################
+PAGE_CACHE_DB_PATH = os.environ.get("ANAVISA_PAGE_CACHE_DB", os.path.join(os.getcwd(), "page_cache.sqlite3"))
+PAGE_CACHE_MAX_AGE = 90 * 24 * 60 * 60  # páginas sem uso há mais tempo são descartadas
+
+def _raw_stream_bytes(obj):
+    # Bytes como estão no arquivo (sem descomprimir): basta para detectar mudança
+    obj = obj.get_object()
+    if isinstance(obj, list):
+        return b"".join(_raw_stream_bytes(item) for item in obj)
+    return getattr(obj, "_data", b"") or b""
+
+def _hash_xobjects(resources, digest, visited):
+    resources = resources.get_object() if resources is not None else None
+    if not resources or "/XObject" not in resources:
+        return
+    xobjects = resources["/XObject"].get_object()
+    for name in sorted(xobjects.keys()):
+        xobject = xobjects[name].get_object()
+        if id(xobject) in visited:
+            continue
+        visited.add(id(xobject))
+        digest.update(name.encode("utf-8"))
+        digest.update(_raw_stream_bytes(xobject))
+        # Formulários podem conter outras imagens
+        _hash_xobjects(xobject.get("/Resources"), digest, visited)
+
+def page_content_hash(page):
+    """
+    SHA-256 do conteúdo da página: fluxos de conteúdo, dados brutos dos XObjects
+    (imagens digitalizadas, formulários), tamanho e rotação. O mesmo documento
+    anexado em outra posição do processo tem o mesmo hash.
+    """
+    digest = hashlib.sha256()
+    digest.update(repr((list(page.mediabox), page.get("/Rotate", 0))).encode("utf-8"))
+    if "/Contents" in page:
+        digest.update(_raw_stream_bytes(page["/Contents"]))
+    _hash_xobjects(page.get("/Resources"), digest, set())
+    return digest.hexdigest()
+
+# Configurações que mudam o resultado de uma página (texto, OCR e entidades). As demais
+# (lotes, processos, download seletivo, parada antecipada, triagem) mudam só quais
+# páginas são processadas ou como, e não invalidam o que já foi extraído.
+PAGE_RESULT_SETTINGS = (
+    "dpi", "psm_mode", "oem_mode", "lang", "preprocess", "deskew", "crop_borders", "ocr_backend",
+    "adaptive_dpi", "adaptive_low_dpi", "adaptive_min_confidence", "ner_relevant_pages_only",
+)
+
+def _ner_model_id():
+    model = globals().get("nlp")
+    if model is None:
+        return None
+    return f"{model.meta.get('lang')}_{model.meta.get('name')}-{model.meta.get('version')}"
+
+def settings_fingerprint(settings):
+    """
+    Identifica as configurações de extração que afetam cada página (PAGE_RESULT_SETTINGS)
+    e o modelo de NER carregado: resultados de uma página só são reaproveitados quando
+    foram obtidos com os mesmos valores.
+    """
+    settings = resolve_extraction_settings(settings)
+    key = [(name, settings[name]) for name in PAGE_RESULT_SETTINGS] + [("ner_model", _ner_model_id())]
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()[:16]
+
+class PageStore:
+    """
+    Resultados por página (texto, origem, endereços, identificadores e entidades),
+    indexados pelo hash de conteúdo da página e pelas configurações de extração.
+    """
+
+    def __init__(self, db_path=PAGE_CACHE_DB_PATH):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS pages (
+                    page_hash TEXT NOT NULL,
+                    settings_key TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    origin TEXT NOT NULL,
+                    fields TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    used_at REAL NOT NULL,
+                    PRIMARY KEY (page_hash, settings_key)
+                )
+            """)
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def get_many(self, page_hashes, settings_key):
+        """
+        {hash: {'text', 'origin', 'addresses', 'ocr_addresses', 'identifiers', 'entities'}}
+        para os hashes já armazenados.
+        """
+        found = {}
+        unique_hashes = list(dict.fromkeys(page_hashes))
+        with closing(self._connect()) as conn:
+            # Lotes para respeitar o limite de parâmetros do SQLite
+            for start in range(0, len(unique_hashes), 500):
+                chunk = unique_hashes[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = conn.execute(
+                    f"SELECT page_hash, text, origin, fields FROM pages "
+                    f"WHERE settings_key = ? AND page_hash IN ({placeholders})",
+                    (settings_key, *chunk)
+                ).fetchall()
+                for row in rows:
+                    found[row["page_hash"]] = {"text": row["text"], "origin": row["origin"], **json.loads(row["fields"])}
+            if found:
+                conn.executemany(
+                    "UPDATE pages SET used_at = ? WHERE page_hash = ? AND settings_key = ?",
+                    [(time.time(), page_hash, settings_key) for page_hash in found]
+                )
+        return found
+
+    def save(self, page_hash, settings_key, text, origin, fields):
+        now = time.time()
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO pages (page_hash, settings_key, text, origin, fields, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (page_hash, settings_key, text, origin, json.dumps(fields, ensure_ascii=False), now, now)
+            )
+
+    def prune(self, max_age=PAGE_CACHE_MAX_AGE):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM pages WHERE used_at < ?", (time.time() - max_age,))
+
+    def clear(self):
+        with closing(self._connect()) as conn:
+            conn.execute("DELETE FROM pages")
+
+def iter_pdf_pages_incremental(pdf_path, settings, store, ocr_pages=None, refresh=False):
+    """
+    Como iter_pdf_pages, mas páginas cujo hash já está no PageStore vêm do
+    armazenamento (record['cached'] = True, com os campos em record['stored']);
+    só as novas ou alteradas passam pela extração/OCR. record['hash'] acompanha
+    cada página, para gravar o resultado depois.
+    - refresh: ignora o que está armazenado e extrai todas as páginas de novo
+      (os resultados novos substituem os antigos no PageStore).
+    """
+    settings = resolve_extraction_settings(settings)
+    reader = PdfReader(pdf_path)
+    total_pages = len(reader.pages)
+    page_hashes = [page_content_hash(page) for page in reader.pages]
+    stored = {} if refresh else store.get_many(page_hashes, settings_fingerprint(settings))
+
+    missing_pages = [idx for idx, page_hash in enumerate(page_hashes, start=1) if page_hash not in stored]
+    fresh_records = iter_pdf_pages(pdf_path, settings, pages=missing_pages, ocr_pages=ocr_pages)
+
+    for idx, page_hash in enumerate(page_hashes, start=1):
+        if page_hash in stored:
+            cached = stored[page_hash]
+            yield {
+                "page": idx,
+                "text": cached["text"],
+                "origin": cached["origin"],
+                "seconds": 0.0,
+                "total_pages": total_pages,
+                "hash": page_hash,
+                "cached": True,
+                "stored": cached,
+            }
+        else:
+            # iter_pdf_pages devolve as páginas faltantes na mesma ordem
+            record = next(fresh_records)
+            record.update({"hash": page_hash, "cached": False})
+            yield record
+
+@st.cache_resource
+def get_page_store():
+    store = PageStore()
+    store.prune()
+    return store
+
+###############################################################################
+# Extração incremental (consome iter_pdf_pages página a página)
+###############################################################################
+def _merge_page_info(info, page_info):
+    # Primeiro nome/CNPJ/CPF encontrado vale para o processo, como no texto completo
+    for field in ("nome_autuado", "cpf", "cnpj"):
+        if not info[field] and page_info.get(field):
+            info[field] = page_info[field]
+    for field in ("socios_advogados", "emails"):
+        for value in page_info.get(field, []):
+            if value not in info[field]:
+                info[field].append(value)
+
+def extract_streaming(pdf_path, settings=None, on_page=None, refresh_pages=False):
+    """
+    Extrai endereços e informações página a página, sem montar o texto do processo
+    inteiro em memória. on_page(evento) é chamado após cada página com o registro
+    da página e os resultados parciais, para exibição progressiva.
+    Com refresh_pages, nenhuma página é reaproveitada do PageStore (reprocessamento forçado).
+    Retorna (info, endereços, relatório).
+    """
+    settings = resolve_extraction_settings(settings)
+    ocr_pages = triaged_ocr_pages(pdf_path, settings)
+
+    info = {"nome_autuado": None, "cpf": None, "cnpj": None, "socios_advogados": [], "emails": [], "entidades": []}
+    addresses = []
+    report = {"pages_with_text": 0, "ocr_pages": [], "reused_pages": 0, "ocr_quality": [], "seconds": 0.0}
+    store = get_page_store() if settings["incremental_pages"] else None
+    settings_key = settings_fingerprint(settings) if store else None
+    # Páginas aguardando o NER, processadas em lote por nlp.pipe. Cada item é
+    # (página, texto, entidades_armazenadas, registro_a_gravar); páginas do cache
+    # também passam pela fila para que as entidades sejam aplicadas em ordem.
+    ner_pages = []
+
+    def save_page(record, fields, entities):
+        # Páginas sem OCR pela triagem não são gravadas: com outra triagem, precisam de OCR
+        if store is None or record.get("cached", True) or record.get("ocr_skipped"):
+            return
+        fields["entities"] = [
+            {key: entity[key] for key in ("texto", "rotulo", "inicio", "fim")} for entity in entities
+        ]
+        store.save(record["hash"], settings_key, record["text"], record["origin"], fields)
+
+    def flush_ner():
+        fresh = [(page, text) for page, text, stored_entities, _ in ner_pages if stored_entities is None]
+        by_page = {}
+        if fresh:
+            # Um processo só: com n_process > 1, cada lote abriria um novo pool de workers
+            for entity in extract_entities(fresh, batch_size=settings["ner_batch_size"], n_process=1):
+                by_page.setdefault(entity["pagina"], []).append(entity)
+        for page, _, stored_entities, pending in ner_pages:
+            if stored_entities is None:
+                entities = by_page.get(page, [])
+                save_page(*pending, entities)
+            else:
+                entities = [dict(entity, pagina=page) for entity in stored_entities]
+            apply_entities(info, entities)
+        ner_pages.clear()
+
+    if store is not None:
+        records = iter_pdf_pages_incremental(pdf_path, settings, store, ocr_pages=ocr_pages, refresh=refresh_pages)
+    else:
+        records = iter_pdf_pages(pdf_path, settings, ocr_pages=ocr_pages)
+
+    for record in records:
+        report["seconds"] += record["seconds"]
+        if record["origin"] == "ocr":
+            report["ocr_pages"].append(record["page"])
+        if record.get("ocr_quality"):
+            report["ocr_quality"].append(record["ocr_quality"])
+        cached = record.get("stored")
+        if cached:
+            report["reused_pages"] += 1
+
+        page_text = record["text"]
+        page_addresses = []
+        if page_text.strip():
+            report["pages_with_text"] += 1
+            file_origin = f"{os.path.basename(pdf_path)} - Página {record['page']}"
+            if cached:
+                page_addresses = [dict(address) for address in cached["addresses"]]
+                page_addresses += [dict(address, source=file_origin) for address in cached["ocr_addresses"]]
+                identifiers = cached["identifiers"]
+            else:
+                page_addresses = extract_addresses_with_source(page_text)
+                ocr_addresses = []
+                if record["origin"] == "ocr":
+                    ocr_addresses = extract_addresses_from_ocr_text(page_text, file_origin)
+                identifiers = extract_identifiers(page_text)
+                fields = {"addresses": page_addresses, "ocr_addresses": ocr_addresses, "identifiers": identifiers}
+                page_addresses = page_addresses + ocr_addresses
+            addresses.extend(page_addresses)
+            _merge_page_info(info, identifiers)
+
+            if not settings["ner_relevant_pages_only"] or classify_page(page_text):
+                if cached:
+                    ner_pages.append((record["page"], page_text, cached["entities"], None))
+                else:
+                    ner_pages.append((record["page"], page_text, None, (record, fields)))
+                if len(ner_pages) >= settings["ner_batch_size"]:
+                    flush_ner()
+            elif not cached:
+                save_page(record, fields, [])
+        elif not cached:
+            save_page(record, {"addresses": [], "ocr_addresses": [], "identifiers": {}}, [])
+
+        if on_page:
+            on_page({
+                "page": record["page"],
+                "total_pages": record["total_pages"],
+                "origin": record["origin"],
+                "seconds": record["seconds"],
+                "new_addresses": page_addresses,
+                "info": dict(info),
+            })
+
+    if ner_pages:
+        flush_ner()
+    return info, addresses, report
+
+###############################################################################
+# Extração incremental com parada antecipada
+###############################################################################
+# Campos exigidos pelos modelos de notificação (_gerar_modelo_*)
+REQUIRED_NOTIFICATION_FIELDS = ("nome_autuado", "identificador", "endereco", "email")
+
+EMAIL_PATTERN = re.compile(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+")
+NOME_ROTULADO_PATTERN = re.compile(
+    r"(?:Autuad[oa]|Raz[aã]o Social|Destinat[aá]rio|Interessad[oa])\s*:\s*([^\n:]{3,120})",
+    re.IGNORECASE
+)
+def _address_confidence(address):
+    filled = [f for f in ADDRESS_FIELDS if address.get(f) and address.get(f) != "[Não informado]"]
+    return len(filled) / len(ADDRESS_FIELDS)
+
+def score_page_fields(page_text, page_addresses):
+    """
+    Extrai os campos da notificação de uma única página, cada um com uma confiança (0 a 1):
+    - CNPJ/CPF com dígito verificador válido: 1.0
+    - e-mail reconhecido por regex: 1.0
+    - nome após rótulo (Autuado, Razão Social...): 1.0; entidade do spaCy em página
+      com CNPJ/CPF: 0.8; entidade do spaCy isolada: 0.5
+    - endereço: fração dos campos (endereço, cidade, bairro, estado, CEP) preenchidos
+    """
+    info = extract_information_spacy(page_text)
+    fields = {}
+
+    labeled_name = NOME_ROTULADO_PATTERN.search(page_text)
+    if labeled_name:
+        fields["nome_autuado"] = (labeled_name.group(1).strip(), 1.0)
+    elif info.get("nome_autuado"):
+        confidence = 0.8 if (info.get("cnpj") or info.get("cpf")) else 0.5
+        fields["nome_autuado"] = (info["nome_autuado"], confidence)
+
+    if info.get("cnpj"):
+        fields["identificador"] = ({"cnpj": info["cnpj"]}, 1.0)
+    elif info.get("cpf"):
+        fields["identificador"] = ({"cpf": info["cpf"]}, 1.0)
+
+    emails = EMAIL_PATTERN.findall(page_text) + info.get("emails", [])
+    if emails:
+        fields["email"] = (emails, 1.0)
+
+    if page_addresses:
+        best_address = max(page_addresses, key=_address_confidence)
+        fields["endereco"] = (best_address, _address_confidence(best_address))
+
+    fields["socios_advogados"] = (info.get("socios_advogados", []), 1.0)
+    return fields
+
+def _page_priority_order(reader, pdf_path, settings):
+    """
+    Ordena as páginas pela quantidade de pistas (AR, AIS, Endereço, CNPJ, CEP).
+    Usa a camada de texto; páginas digitalizadas só são classificadas se a triagem
+    em baixa resolução estiver ativa, senão mantêm a ordem original no fim da fila.
+    Retorna (ordem, textos_da_camada_de_texto).
+    """
+    text_layers = {}
+    cue_counts = {}
+    for idx, pdf_page in enumerate(reader.pages, start=1):
+        try:
+            page_text = pdf_page.extract_text() or ""
+        except Exception as e:
+            logging.error(f"Erro ao ler a camada de texto da página {idx}: {e}")
+            page_text = ""
+        if len(page_text.strip()) >= MIN_TEXT_LAYER_CHARS:
+            text_layers[idx] = page_text
+            cue_counts[idx] = len(classify_page(page_text))
+
+    if settings["triage"] and len(text_layers) < len(reader.pages):
+        _, report = triage_pages(pdf_path, settings)
+        for entry in report:
+            cue_counts.setdefault(entry["page"], len(entry["cues"]))
+
+    pages = range(1, len(reader.pages) + 1)
+    order = sorted(pages, key=lambda idx: (-cue_counts.get(idx, 0), idx))
+    return order, text_layers
+
+def extract_with_early_exit(pdf_path, settings=None, confidence_threshold=0.8):
+    """
+    Percorre as páginas em ordem de prioridade (leitura da camada de texto ou OCR,
+    seguida da extração de campos, página a página) e para assim que todos os
+    campos exigidos atingem a confiança mínima.
+    Retorna (texto_processado, info, endereços, relatório); o relatório lista as
+    páginas processadas e as ignoradas.
+    """
+    settings = resolve_extraction_settings(settings)
+    reader = PdfReader(pdf_path)
+    order, text_layers = _page_priority_order(reader, pdf_path, settings)
+
+    best = {}
+    emails = []
+    socios_advogados = []
+    addresses = []
+    page_texts = {}
+    processed_pages = []
+
+    for idx in order:
+        if idx in text_layers:
+            page_text = corrigir_texto(normalize_text(text_layers[idx]))
+            page_addresses = extract_addresses_with_source(page_text)
+        else:
+            page_text, page_addresses = ocr_extract(
+                pdf_path,
+                psm_mode=settings["psm_mode"],
+                oem_mode=settings["oem_mode"],
+                dpi=settings["dpi"],
+                lang=settings["lang"],
+                settings=settings,
+                pages=[idx]
+            )
+            page_addresses = page_addresses + extract_addresses_with_source(page_text)
+
+        processed_pages.append(idx)
+        page_texts[idx] = page_text
+        addresses.extend(page_addresses)
+
+        for field, (value, confidence) in score_page_fields(page_text, page_addresses).items():
+            if field == "email":
+                emails.extend(value)
+            elif field == "socios_advogados":
+                socios_advogados.extend(value)
+            if confidence > best.get(field, (None, 0.0, None))[1]:
+                best[field] = (value, confidence, idx)
+
+        if all(best.get(field, (None, 0.0, None))[1] >= confidence_threshold for field in REQUIRED_NOTIFICATION_FIELDS):
+            break
+
+    identificador = best.get("identificador", ({}, 0.0, None))[0]
+    info = {
+        "nome_autuado": best.get("nome_autuado", (None, 0.0, None))[0],
+        "cpf": identificador.get("cpf"),
+        "cnpj": identificador.get("cnpj"),
+        "socios_advogados": socios_advogados,
+        "emails": extract_all_emails(emails),
+    }
+
+    skipped_pages = sorted(set(order) - set(processed_pages))
+    report = {
+        "processed_pages": processed_pages,
+        "skipped_pages": skipped_pages,
+        "stopped_early": bool(skipped_pages),
+        "fields": {
+            field: {"page": best[field][2], "confidence": best[field][1]}
+            for field in REQUIRED_NOTIFICATION_FIELDS if field in best
+        },
+    }
+
+    # Texto na ordem natural das páginas, como no fluxo completo
+    text = corrigir_texto(normalize_text("\n".join(page_texts[idx] for idx in sorted(page_texts))))
+    return text, info, addresses, report
+
+###############################################################################
+# Pipeline com cache (download → extração → NER)
+###############################################################################
+# O cache é compartilhado entre sessões no servidor (st.cache_data), ao contrário
+# de st.session_state, que é por aba do navegador e se perde ao recarregar.
+PIPELINE_CACHE_TTL = 6 * 60 * 60  # segundos
+PIPELINE_CACHE_MAX_ENTRIES = 64
+
+@st.cache_resource
+def _pipeline_cache_generations():
+    """
+    Contador de invalidação por processo, compartilhado entre sessões.
+    Incrementar o contador muda a chave do cache e força o reprocessamento.
+    """
+    return {"lock": threading.Lock(), "generations": {}}
+
+def _normalize_process_key(process_number):
+    return re.sub(r"\s+", "", process_number or "")
+
+def _pipeline_generation(process_number):
+    state = _pipeline_cache_generations()
+    with state["lock"]:
+        return state["generations"].get(_normalize_process_key(process_number), 0)
+
+def invalidate_pipeline_cache(process_number=None):
+    """
+    Invalida o cache do pipeline.
+    - Com process_number: apenas as entradas daquele processo.
+    - Sem process_number: todo o cache.
+    """
+    if process_number is None:
+        _run_pipeline_cached.clear()
+        return
+    state = _pipeline_cache_generations()
+    key = _normalize_process_key(process_number)
+    with state["lock"]:
+        state["generations"][key] = state["generations"].get(key, 0) + 1
+
+def run_pipeline(process_number, credential_token, settings=None, headless=True, on_page=None,
+                 on_wait=None, session_id=None, refresh_pages=False):
+    """
+    Executa download → extração de texto/OCR → NER para um processo.
+    O resultado fica em cache por número do processo e configurações de extração.
+    - on_page: recebe o progresso de cada página (ver extract_streaming). Como funções
+      em cache não podem escrever em elementos do Streamlit criados fora delas, o
+      pipeline roda numa thread e os eventos são entregues aqui, na thread do script.
+    - on_wait: recebe a posição na fila do pool de navegadores (0 = liberado).
+    - session_id: perfil de navegador da sessão (ver BrowserPool).
+    - refresh_pages: não reaproveita páginas do PageStore (usar junto com
+      invalidate_pipeline_cache para reprocessar o processo do zero).
+    - O cache é separado por credenciais (CredentialVault.scope): um resultado só é
+      servido a quem o gerou, isto é, a quem fez login no SEI com o mesmo usuário e
+      senha. Outro usuário, ou senha errada, executa o pipeline (e o login) de novo.
+    """
+    settings = resolve_extraction_settings(settings)
+    args = (
+        _normalize_process_key(process_number),
+        tuple(sorted(settings.items())),
+        _pipeline_generation(process_number),
+        get_credential_vault().scope(credential_token),
+        credential_token,
+        headless,
+    )
+    if on_page is None and on_wait is None:
+        return _run_pipeline_cached(*args, _session_id=session_id, _refresh_pages=refresh_pages)
+
+    events = queue.Queue()
+    outcome = {}
+
+    def worker():
+        try:
+            outcome["result"] = _run_pipeline_cached(
+                *args,
+                _on_page=(lambda event: events.put((on_page, event))) if on_page else None,
+                _session_id=session_id,
+                _on_wait=(lambda position: events.put((on_wait, position))) if on_wait else None,
+                _refresh_pages=refresh_pages
+            )
+        except Exception as e:
+            outcome["error"] = e
+        finally:
+            events.put(None)
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    while True:
+        item = events.get()
+        if item is None:
+            break
+        callback, event = item
+        callback(event)
+    thread.join()
+
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+@st.cache_data(ttl=PIPELINE_CACHE_TTL, max_entries=PIPELINE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _run_pipeline_cached(process_key, settings_items, generation, credential_scope, _credential_token,
+                         _headless=True, _on_page=None, _session_id=None, _on_wait=None, _refresh_pages=False):
+    """
+    Parâmetros iniciados por '_' não entram na chave do cache
+    (credenciais, modo headless, sessão, callbacks de progresso e reprocessamento
+    das páginas não alteram o resultado).
+    Exceções não são armazenadas, então falhas são refeitas no próximo clique e só
+    há resultado em cache para um credential_scope cujo login no SEI funcionou.
+    """
+    return execute_pipeline(
+        process_key,
+        dict(settings_items),
+        _credential_token,
+        headless=_headless,
+        on_page=_on_page,
+        session_id=_session_id,
+        on_wait=_on_wait,
+        refresh_pages=_refresh_pages
+    )
+
+def execute_pipeline(process_key, settings, credential_token, headless=True, on_page=None, session_id=None, on_wait=None,
+                     refresh_pages=False):
+    """
+    Download → extração → NER → deduplicação/CEP, sem cache (ver run_pipeline).
+    """
+    settings = resolve_extraction_settings(settings)
+
+    download_path = process_notification(
+        credential_token,
+        process_key,
+        headless=headless,
+        document_patterns=document_patterns_for(settings),
+        session_id=session_id,
+        on_wait=on_wait
+    )
+    if not download_path:
+        raise Exception("O PDF do processo não foi baixado.")
+
+    pdf_file_name = os.path.basename(download_path)
+    numero_processo = extract_process_number(pdf_file_name)
+
+    extraction_report = None
+    if settings["early_exit"]:
+        text_final, info, all_addresses, extraction_report = extract_with_early_exit(
+            download_path, settings, confidence_threshold=settings["early_exit_confidence"]
+        )
+        has_text = bool(text_final.strip())
+    else:
+        # Página a página: endereços (AR/AIS e OCR) e informações chegam à tela aos poucos
+        info, all_addresses, stream_report = extract_streaming(
+            download_path, settings, on_page=on_page, refresh_pages=refresh_pages
+        )
+        has_text = stream_report["pages_with_text"] > 0
+        extraction_report = stream_report
+
+    if not has_text:
+        raise Exception("Não foi possível extrair texto do PDF do processo.")
+
+    # O mesmo endereço aparece em várias páginas (AR, AIS, OCR): lista curta para o operador
+    all_addresses = deduplicate_addresses(all_addresses)
+    all_addresses = enrich_addresses_with_cep(all_addresses, get_cep_index())
+
+    return {
+        "download_path": download_path,
+        "numero_processo": numero_processo,
+        "info": info,
+        "addresses_raw": all_addresses,
+        "emails": extract_all_emails(info.get('emails', [])),
+        "extraction_report": extraction_report,
+        "processed_at": time.time(),
+    }
+
 ###############################################################################
 # Modelos Word
 ###############################################################################
@@ -857,10 +3037,577 @@ def _gerar_modelo_3(doc, info, enderecos, numero_processo, usuario_nome, usuario
     except Exception as e:
         st.error(f"Erro ao gerar o documento no modelo 3: {e}")
 
+###############################################################################
+# Fila de processamento em lote (SQLite)
+###############################################################################
+# Cada processo avança pelas etapas abaixo; o estado fica no SQLite local, então
+# uma queda do Streamlit, do worker ou do SEI não perde o que já foi concluído.
+JOBS_DB_PATH = os.environ.get("ANAVISA_JOBS_DB", os.path.join(os.getcwd(), "jobs.sqlite3"))
+JOB_ARTIFACTS_DIR = os.path.join(os.getcwd(), "artifacts")
+JOB_STAGES = ("download", "extract", "ner", "render")
+JOB_MAX_ATTEMPTS = 4
+JOB_BACKOFF_SECONDS = 30  # dobra a cada nova tentativa
+JOB_STALE_SECONDS = 30 * 60  # job 'running' sem atualização: worker caiu
+JOB_HEARTBEAT_SECONDS = 60  # intervalo em que o worker renova o job durante a etapa
+
+# Falhas transitórias do SEI: a etapa é repetida com espera crescente. As mesmas que
+# o circuit breaker conta (timeouts e erros de conexão do Playwright), mais o circuito aberto.
+RETRYABLE_JOB_ERRORS = (*SEI_FAILURE_ERRORS, SEIUnavailableError)
+
+class JobStore:
+    """
+    Persistência dos jobs de lote. Um job por número de processo, com a próxima
+    etapa a executar, artefatos (JSON), tentativas e último erro.
+    """
+
+    def __init__(self, db_path=JOBS_DB_PATH):
+        self.db_path = db_path
+        with closing(self._connect()) as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    process_number TEXT PRIMARY KEY,
+                    batch_id TEXT,
+                    stage TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    artifacts TEXT NOT NULL DEFAULT '{}',
+                    error TEXT,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, next_attempt_at)")
+
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        # WAL: vários workers lendo enquanto um grava
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    @staticmethod
+    def _row_to_job(row):
+        job = dict(row)
+        job["artifacts"] = json.loads(job["artifacts"] or "{}")
+        return job
+
+    def enqueue(self, process_numbers, batch_id=None):
+        """
+        Inclui processos na fila. Processos já existentes são mantidos como estão,
+        de modo que reenviar um lote retoma de onde parou.
+        """
+        now = time.time()
+        with closing(self._connect()) as conn:
+            for process_number in process_numbers:
+                conn.execute(
+                    "INSERT OR IGNORE INTO jobs (process_number, batch_id, stage, status, created_at, updated_at) "
+                    "VALUES (?, ?, ?, 'pending', ?, ?)",
+                    (_normalize_process_key(process_number), batch_id, JOB_STAGES[0], now, now)
+                )
+
+    def claim_next(self, worker_id):
+        """
+        Reserva atomicamente o próximo job pendente cuja espera já terminou.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND next_attempt_at <= ? "
+                "ORDER BY next_attempt_at, created_at LIMIT 1",
+                (time.time(),)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', worker = ?, updated_at = ? WHERE process_number = ?",
+                (worker_id, time.time(), row["process_number"])
+            )
+            conn.execute("COMMIT")
+            job = self._row_to_job(row)
+            job["status"] = "running"
+            return job
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def complete_stage(self, process_number, stage, artifacts):
+        """
+        Registra a conclusão da etapa e os artefatos; o job segue para a próxima etapa.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT artifacts FROM jobs WHERE process_number = ?", (process_number,)).fetchone()
+            merged = json.loads(row["artifacts"] or "{}") if row else {}
+            merged.update(artifacts)
+            position = JOB_STAGES.index(stage)
+            next_stage = JOB_STAGES[position + 1] if position + 1 < len(JOB_STAGES) else "done"
+            conn.execute(
+                "UPDATE jobs SET stage = ?, status = ?, attempts = 0, next_attempt_at = 0, "
+                "artifacts = ?, error = NULL, worker = NULL, updated_at = ? WHERE process_number = ?",
+                (next_stage, "done" if next_stage == "done" else "pending",
+                 json.dumps(merged, ensure_ascii=False), time.time(), process_number)
+            )
+
+    def fail(self, process_number, error, retryable):
+        """
+        Registra a falha da etapa atual. Falhas transitórias voltam para a fila com
+        espera exponencial até JOB_MAX_ATTEMPTS; as demais marcam o job como 'failed'.
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT attempts FROM jobs WHERE process_number = ?", (process_number,)).fetchone()
+            attempts = (row["attempts"] if row else 0) + 1
+            if retryable and attempts < JOB_MAX_ATTEMPTS:
+                status = "pending"
+                next_attempt_at = time.time() + JOB_BACKOFF_SECONDS * 2 ** (attempts - 1)
+            else:
+                status = "failed"
+                next_attempt_at = 0
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, next_attempt_at = ?, error = ?, "
+                "worker = NULL, updated_at = ? WHERE process_number = ?",
+                (status, attempts, next_attempt_at, str(error), time.time(), process_number)
+            )
+
+    def defer(self, process_number, until, error):
+        """
+        Devolve o job à fila até `until` sem contar tentativa (ex.: circuito do SEI aberto).
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', next_attempt_at = ?, error = ?, "
+                "worker = NULL, updated_at = ? WHERE process_number = ?",
+                (until, str(error), time.time(), process_number)
+            )
+
+    def heartbeat(self, process_number, worker_id):
+        """
+        Renova updated_at do job em execução por este worker. Retorna False se o job
+        não está mais com ele.
+        """
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET updated_at = ? WHERE process_number = ? AND status = 'running' AND worker = ?",
+                (time.time(), process_number, worker_id)
+            )
+            return cursor.rowcount > 0
+
+    @contextmanager
+    def keep_alive(self, process_number, worker_id, interval=JOB_HEARTBEAT_SECONDS):
+        """
+        Renova o job a cada `interval` segundos numa thread enquanto o bloco executa,
+        para que etapas longas (OCR de PDFs grandes) não sejam tomadas por
+        requeue_stale como abandonadas.
+        """
+        stop = threading.Event()
+
+        def beat():
+            while not stop.wait(interval):
+                try:
+                    if not self.heartbeat(process_number, worker_id):
+                        return
+                except sqlite3.Error as e:
+                    logging.error(f"Erro ao renovar o job {process_number}: {e}")
+
+        thread = threading.Thread(target=beat, daemon=True)
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+
+    def requeue_stale(self, stale_seconds=JOB_STALE_SECONDS):
+        """
+        Devolve à fila os jobs 'running' abandonados (worker interrompido no meio da etapa).
+        Workers ativos renovam o job (ver keep_alive), então só os sem renovação há
+        stale_seconds são devolvidos.
+        """
+        with closing(self._connect()) as conn:
+            conn.execute(
+                "UPDATE jobs SET status = 'pending', worker = NULL WHERE status = 'running' AND updated_at < ?",
+                (time.time() - stale_seconds,)
+            )
+
+    def retry_failed(self, batch_id=None):
+        with closing(self._connect()) as conn:
+            query = "UPDATE jobs SET status = 'pending', attempts = 0, next_attempt_at = 0 WHERE status = 'failed'"
+            params = ()
+            if batch_id:
+                query += " AND batch_id = ?"
+                params = (batch_id,)
+            conn.execute(query, params)
+
+    def next_wakeup(self):
+        """
+        Momento da próxima tentativa agendada (ou None se não há pendentes).
+        """
+        with closing(self._connect()) as conn:
+            row = conn.execute("SELECT MIN(next_attempt_at) AS t FROM jobs WHERE status = 'pending'").fetchone()
+            return row["t"] if row else None
+
+    def list_jobs(self, batch_id=None):
+        with closing(self._connect()) as conn:
+            if batch_id:
+                rows = conn.execute("SELECT * FROM jobs WHERE batch_id = ? ORDER BY created_at", (batch_id,)).fetchall()
+            else:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY created_at").fetchall()
+            return [self._row_to_job(row) for row in rows]
+
+def _safe_filename(name):
+    return re.sub(r"[^\w.-]", "_", name)
+
+def _job_artifacts_dir(process_number):
+    path = os.path.join(JOB_ARTIFACTS_DIR, _safe_filename(process_number))
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def run_job_stage(job, credential_token, settings=None, headless=True, vault=None, session_id=None):
+    """
+    Executa a etapa pendente do job e retorna os artefatos produzidos.
+    Textos e documentos vão para arquivos; metadados pequenos ficam no próprio job.
+    """
+    settings = resolve_extraction_settings(settings)
+    stage = job["stage"]
+    artifacts = job["artifacts"]
+    process_number = job["process_number"]
+
+    if stage == "download":
+        download_path = process_notification(
+            credential_token, process_number, headless=headless, vault=vault,
+            document_patterns=document_patterns_for(settings), session_id=session_id
+        )
+        if not download_path:
+            raise Exception("O PDF do processo não foi baixado.")
+        # Tira o PDF da pasta de downloads da sessão, que é apagada quando fica sem uso
+        job_pdf_path = os.path.join(_job_artifacts_dir(process_number), os.path.basename(download_path))
+        shutil.move(download_path, job_pdf_path)
+        return {
+            "pdf_path": job_pdf_path,
+            "numero_processo": extract_process_number(os.path.basename(download_path)),
+        }
+
+    if stage == "extract":
+        # Grava página a página (separadas por \\f): memória constante em PDFs grandes
+        text_path = os.path.join(_job_artifacts_dir(process_number), "texto.txt")
+        enderecos_ocr = []
+        has_text = False
+        ocr_pages = triaged_ocr_pages(artifacts["pdf_path"], settings)
+        with open(text_path, "w", encoding="utf-8") as text_file:
+            for record in iter_pdf_pages(artifacts["pdf_path"], settings, ocr_pages=ocr_pages):
+                text_file.write(record["text"] + "\f")
+                has_text = has_text or bool(record["text"].strip())
+                if record["origin"] == "ocr":
+                    file_origin = f"{os.path.basename(artifacts['pdf_path'])} - Página {record['page']}"
+                    enderecos_ocr.extend(extract_addresses_from_ocr_text(record["text"], file_origin))
+        if not has_text:
+            raise Exception("Não foi possível extrair texto do PDF do processo.")
+        return {"text_path": text_path, "addresses_ocr": enderecos_ocr}
+
+    if stage == "ner":
+        with open(artifacts["text_path"], encoding="utf-8") as text_file:
+            text_final = text_file.read()
+        info = extract_information_spacy(
+            text_final,
+            only_pages=relevant_text_pages(text_final) if settings["ner_relevant_pages_only"] else None,
+            batch_size=settings["ner_batch_size"],
+            n_process=settings["ner_processes"]
+        )
+        addresses = extract_addresses_with_source(text_final) + artifacts.get("addresses_ocr", [])
+        addresses = enrich_addresses_with_cep(deduplicate_addresses(addresses), get_cep_index())
+        return {"info": info, "addresses": addresses, "emails": extract_all_emails(info.get('emails', []))}
+
+    if stage == "render":
+        doc = Document()
+        emails = artifacts.get("emails") or ["[Não informado]"]
+        numero_processo = artifacts.get("numero_processo", process_number)
+        _gerar_modelo_1(doc, artifacts["info"], artifacts["addresses"], numero_processo, emails[0])
+        docx_path = os.path.join(_job_artifacts_dir(process_number), f"Notificacao_{_safe_filename(numero_processo)}.docx")
+        doc.save(docx_path)
+        return {"docx_path": docx_path}
+
+    raise Exception(f"Etapa desconhecida: {stage}")
+
+def run_batch_worker(store, credential_token, settings=None, headless=True,
+                     worker_id=None, on_progress=None, max_wait=None, vault=None, session_id=None):
+    """
+    Consome a fila até não restar job pendente. Jobs em espera (backoff) são
+    aguardados; com max_wait (segundos), o worker desiste de esperar além disso
+    e os deixa pendentes para a próxima execução.
+    O token de credenciais pode vir de outro processo (ver CredentialVault).
+    """
+    worker_id = worker_id or f"{os.getpid()}-{threading.get_ident()}"
+    store.requeue_stale()
+
+    while True:
+        job = store.claim_next(worker_id)
+        if job is None:
+            wakeup = store.next_wakeup()
+            if wakeup is None:
+                return
+            wait = max(wakeup - time.time(), 0.5)
+            if max_wait is not None and wait > max_wait:
+                return
+            time.sleep(wait)
+            continue
+
+        stage = job["stage"]
+        try:
+            with store.keep_alive(job["process_number"], worker_id):
+                artifacts = run_job_stage(job, credential_token, settings, headless, vault=vault, session_id=session_id)
+            store.complete_stage(job["process_number"], stage, artifacts)
+        except SEIUnavailableError as e:
+            # O SEI está fora: o job espera o circuito, sem gastar tentativas
+            logging.warning(f"Processo {job['process_number']} adiado ({stage}): {e}")
+            store.defer(job["process_number"], e.retry_at, e)
+        except RETRYABLE_JOB_ERRORS as e:
+            logging.error(f"Falha transitória no processo {job['process_number']} ({stage}): {e}")
+            store.fail(job["process_number"], e, retryable=True)
+        except Exception as e:
+            logging.error(f"Erro no processo {job['process_number']} ({stage}): {e}")
+            store.fail(job["process_number"], e, retryable=False)
+
+        if on_progress:
+            on_progress(job["process_number"], stage)
+
+###############################################################################
+# Perfilamento (diagnóstico de processos lentos)
+###############################################################################
+PROFILES_DIR = os.path.join(os.getcwd(), "profiles")
+PROFILE_TOP_FUNCTIONS = 30
+
+def _render_models_for_profile(result):
+    """
+    Gera os três modelos em documentos descartáveis, para que entrem no perfil.
+    """
+    info = result["info"]
+    addresses = result["addresses_raw"]
+    numero_processo = result["numero_processo"]
+    email = (result["emails"] or ["[Não informado]"])[0]
+    _gerar_modelo_1(Document(), info, addresses, numero_processo, email)
+    today = datetime.date.today()
+    _gerar_modelo_2(Document(), info, addresses, numero_processo, "prescricao", today, today, email_selecionado=email)
+    _gerar_modelo_3(Document(), info, addresses, numero_processo, "[Usuário]", "[E-mail]", "[Órgão]", email)
+
+def profile_summary(stats, top=PROFILE_TOP_FUNCTIONS):
+    """
+    Texto com as funções mais custosas, por tempo acumulado e por tempo próprio.
+    """
+    stream = io.StringIO()
+    stats.stream = stream
+    for sort_key, title in (("cumulative", "tempo acumulado"), ("tottime", "tempo próprio")):
+        stream.write(f"\n=== Top {top} funções por {title} ===\n")
+        stats.sort_stats(sort_key).print_stats(top)
+    return stream.getvalue()
+
+def profile_pipeline(process_number, credential_token, settings=None, headless=True, session_id=None, on_wait=None):
+    """
+    Executa o pipeline completo (sem cache de resultado nem de páginas) e a geração dos modelos sob cProfile.
+    Grava <tag>.prof e <tag>.txt em PROFILES_DIR, com tag = processo, páginas e horário.
+    Retorna (resultado, artefato) com artefato = {'tag', 'prof_path', 'summary_path', 'summary'}.
+    - Só a thread atual é medida: OCR em subprocesso e nlp.pipe com vários processos
+      aparecem como espera, não pelas funções internas.
+    """
+    settings = resolve_extraction_settings(settings)
+    profiler = cProfile.Profile()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        result = execute_pipeline(
+            _normalize_process_key(process_number), settings, credential_token,
+            headless=headless, session_id=session_id, on_wait=on_wait, refresh_pages=True
+        )
+        _render_models_for_profile(result)
+    finally:
+        profiler.disable()
+    elapsed = time.perf_counter() - start
+
+    try:
+        page_count = len(PdfReader(result["download_path"]).pages)
+    except Exception as e:
+        logging.error(f"Erro ao contar as páginas do PDF: {e}")
+        page_count = 0
+
+    processed_at = time.strftime("%Y%m%d-%H%M%S")
+    tag = f"perfil_{_safe_filename(result['numero_processo'] or process_number)}_{page_count}p_{processed_at}"
+    os.makedirs(PROFILES_DIR, exist_ok=True)
+    prof_path = os.path.join(PROFILES_DIR, f"{tag}.prof")
+    summary_path = os.path.join(PROFILES_DIR, f"{tag}.txt")
+
+    profiler.dump_stats(prof_path)
+    header = (
+        f"Processo: {result['numero_processo'] or process_number}\n"
+        f"Páginas: {page_count}\n"
+        f"Data: {processed_at}\n"
+        f"Duração total: {elapsed:.1f} s\n"
+        f"Configurações: {settings}\n"
+    )
+    summary = header + profile_summary(pstats.Stats(profiler))
+    with open(summary_path, "w", encoding="utf-8") as summary_file:
+        summary_file.write(summary)
+
+    return result, {"tag": tag, "prof_path": prof_path, "summary_path": summary_path, "summary": summary}
+
+###############################################################################
+# Editor de endereços (tabela paginada)
+###############################################################################
+ADDRESS_PAGE_SIZES = (25, 50, 100)
+ADDRESS_EDITOR_COLUMNS = {
+    "endereco": "Endereço",
+    "cidade": "Cidade",
+    "bairro": "Bairro",
+    "estado": "Estado",
+    "cep": "CEP",
+}
+
+def _address_source_categories(address):
+    """
+    Origens agrupadas para o filtro: AR, AIS, Desconhecido ou OCR (uma por página).
+    """
+    sources = address.get("sources") or [address.get("source", "Desconhecido")]
+    return {source if source in ("AR", "AIS", "Desconhecido") else "OCR" for source in sources}
+
+def _set_addresses_excluded(indices, excluded):
+    updated = list(st.session_state['addresses_edited'])
+    for idx in indices:
+        updated[idx] = {**updated[idx], "excluded": excluded}
+    st.session_state['addresses_edited'] = updated
+    # Nova versão do editor: descarta o estado de edição anterior da tabela
+    st.session_state['address_editor_version'] = st.session_state.get('address_editor_version', 0) + 1
+
+def _address_editor_value(value):
+    # Campo ausente aparece vazio no editor, e não como o texto "[Não informado]"
+    return "" if value in (None, "[Não informado]") else value
+
+def _address_stored_value(value):
+    # Célula limpa volta do editor como None/NaN/"": no endereço, isso é "[Não informado]"
+    if value is None or pd.isna(value) or not str(value).strip():
+        return "[Não informado]"
+    return str(value).strip()
+
+def render_address_editor():
+    """
+    Mostra os endereços de st.session_state['addresses_edited'] numa tabela editável
+    com paginação, filtro por origem e inclusão/exclusão em massa. Apenas a página
+    atual é renderizada, então o tempo de resposta não cresce com o número de endereços.
+    """
+    addresses = st.session_state['addresses_edited']
+    if not addresses:
+        st.write("Nenhum endereço encontrado.")
+        return
+
+    categories = sorted(set().union(*(_address_source_categories(a) for a in addresses)))
+    col_filter, col_size = st.columns([3, 1])
+    selected_categories = col_filter.multiselect(
+        "Filtrar por origem:", categories, default=categories, key="address_source_filter"
+    )
+    page_size = col_size.selectbox("Por página:", ADDRESS_PAGE_SIZES, key="address_page_size")
+
+    filtered = [
+        idx for idx, address in enumerate(addresses)
+        if _address_source_categories(address) & set(selected_categories)
+    ]
+    total_pages = max(1, -(-len(filtered) // page_size))
+    page_number = st.number_input("Página:", min_value=1, max_value=total_pages, value=1, step=1, key="address_page")
+    page_indices = filtered[(page_number - 1) * page_size:page_number * page_size]
+
+    col_include, col_exclude = st.columns(2)
+    if col_include.button(f"Incluir os {len(filtered)} endereços filtrados"):
+        _set_addresses_excluded(filtered, False)
+    if col_exclude.button(f"Excluir os {len(filtered)} endereços filtrados"):
+        _set_addresses_excluded(filtered, True)
+    addresses = st.session_state['addresses_edited']
+
+    rows = pd.DataFrame(
+        [
+            {
+                "incluir": not addresses[idx].get("excluded", False),
+                **{field: _address_editor_value(addresses[idx].get(field)) for field in ADDRESS_EDITOR_COLUMNS},
+                "origem": addresses[idx].get("source", "Desconhecido"),
+                "alerta": addresses[idx].get("alerta_cep", ""),
+            }
+            for idx in page_indices
+        ],
+        index=page_indices,
+        columns=["incluir", *ADDRESS_EDITOR_COLUMNS, "origem", "alerta"]
+    )
+    editor_key = (
+        f"address_editor_{st.session_state.get('address_editor_version', 0)}"
+        f"_{page_number}_{page_size}_{'|'.join(selected_categories)}"
+    )
+    edited = st.data_editor(
+        rows,
+        key=editor_key,
+        hide_index=True,
+        use_container_width=True,
+        disabled=["origem", "alerta"],
+        column_config={
+            "incluir": st.column_config.CheckboxColumn("Incluir?"),
+            **{field: st.column_config.TextColumn(label) for field, label in ADDRESS_EDITOR_COLUMNS.items()},
+            "origem": st.column_config.TextColumn("Origem"),
+            "alerta": st.column_config.TextColumn("Alerta CEP/UF"),
+        }
+    )
+
+    # Grava todas as alterações da página de uma vez
+    changes = {}
+    for idx, row in edited.iterrows():
+        current = addresses[idx]
+        new_values = {field: _address_stored_value(row[field]) for field in ADDRESS_EDITOR_COLUMNS}
+        excluded = not bool(row["incluir"])
+        if (
+            any(current.get(field, "[Não informado]") != value for field, value in new_values.items())
+            or current.get("excluded", False) != excluded
+        ):
+            changes[idx] = {**current, **new_values, "excluded": excluded}
+    if changes:
+        updated = list(addresses)
+        for idx, address in changes.items():
+            updated[idx] = address
+        st.session_state['addresses_edited'] = updated
+
+    excluded_count = sum(1 for a in st.session_state['addresses_edited'] if a.get("excluded", False))
+    st.caption(
+        f"{len(filtered)} de {len(addresses)} endereço(s) exibidos pelo filtro; "
+        f"{excluded_count} excluído(s) do documento. Página {page_number} de {total_pages}."
+    )
+
 ###############################################################################
 # Aplicação principal (Streamlit)
 ###############################################################################
-def main():
+def browser_session_id():
+    """
+    Identificador do perfil de navegador desta sessão do Streamlit (ver BrowserPool).
+    """
+    if "browser_session_id" not in st.session_state:
+        st.session_state.browser_session_id = uuid.uuid4().hex
+    return st.session_state.browser_session_id
+
+def session_credential_token():
+    """
+    Token de credenciais da sessão: cifrado uma vez e refeito apenas quando
+    usuário ou senha mudam, ou quando o token se aproxima do vencimento.
+    """
+    fingerprint = hashlib.sha256(
+        f"{st.session_state.username_input}\0{st.session_state.password_input}".encode('utf-8')
+    ).hexdigest()
+    token_age = time.time() - st.session_state.get("credential_sealed_at", 0)
+    if st.session_state.get("credential_fingerprint") != fingerprint or token_age > CREDENTIAL_TOKEN_TTL / 2:
+        vault = get_credential_vault()
+        if st.session_state.get("credential_token"):
+            vault.revoke(st.session_state["credential_token"])
+        st.session_state["credential_token"] = vault.seal(
+            st.session_state.username_input, st.session_state.password_input
+        )
+        st.session_state["credential_fingerprint"] = fingerprint
+        st.session_state["credential_sealed_at"] = time.time()
+    return st.session_state["credential_token"]
+
+def main(profile_default=False):
     st.title("Gerador de Notificações SEI-Anvisa")
 
     # Seção de login
@@ -875,6 +3622,70 @@ def main():
     st.session_state.password_input = st.sidebar.text_input("Senha", type="password", value=st.session_state.password_input)
 
     headless_option = st.sidebar.checkbox("Executar sem abrir o navegador (headless)?", value=True)
+
+    # Configurações de extração (fazem parte da chave do cache)
+    st.sidebar.header("Extração")
+    extraction_settings = {
+        "triage": st.sidebar.checkbox(
+            "Triagem rápida: OCR completo só nas páginas de AR/AIS/identificação?", value=False
+        ),
+        "early_exit": st.sidebar.checkbox(
+            "Parar ao encontrar nome, CNPJ/CPF, endereço e e-mail?", value=False
+        ),
+        "ocr_backend": st.sidebar.selectbox(
+            "Motor de OCR:", OCR_BACKENDS,
+            help="'lote' e 'tesserocr' evitam recarregar o Tesseract a cada página."
+        ),
+        "selective_download": st.sidebar.checkbox(
+            "Baixar só os documentos relevantes (AR, AIS, decisão, identificação)?", value=False
+        ),
+        "adaptive_dpi": st.sidebar.checkbox(
+            "OCR adaptativo: baixa resolução primeiro, alta só onde a confiança for baixa?", value=False
+        ),
+    }
+    if extraction_settings["selective_download"]:
+        patterns_text = st.sidebar.text_area(
+            "Tipos de documento (expressões regulares, uma por linha):",
+            value="\n".join(DEFAULT_DOCUMENT_PATTERNS)
+        )
+        patterns = tuple(line.strip() for line in patterns_text.splitlines() if line.strip())
+        try:
+            for pattern in patterns:
+                re.compile(pattern)
+            extraction_settings["document_patterns"] = patterns or DEFAULT_DOCUMENT_PATTERNS
+        except re.error as e:
+            st.sidebar.error(f"Padrão inválido ({e}); usando os tipos padrão.")
+
+    # Cache do pipeline (compartilhado entre sessões)
+    st.sidebar.header("Cache de Processamento")
+    force_reprocess = st.sidebar.checkbox("Ignorar cache e reprocessar o processo?", value=False)
+    if st.sidebar.button("Limpar todo o cache"):
+        invalidate_pipeline_cache()
+        get_page_store().clear()
+        st.sidebar.success("Cache limpo.")
+
+    # Situação do SEI (circuit breaker e tempos limite adaptativos)
+    st.sidebar.header("Situação do SEI")
+    breaker = get_circuit_breaker()
+    if breaker.state == "fechado":
+        st.sidebar.success("SEI respondendo normalmente.")
+    elif breaker.state == "aberto" and time.time() < breaker.retry_at:
+        st.sidebar.error(
+            f"SEI indisponível após {breaker.failures} falha(s). "
+            f"Nova tentativa em {int(breaker.retry_at - time.time())} s."
+        )
+    else:
+        st.sidebar.warning("SEI em verificação: a próxima requisição testa a conexão.")
+    latency_summary = get_latency_tracker().summary()
+    if latency_summary:
+        st.sidebar.dataframe(pd.DataFrame(latency_summary), hide_index=True, use_container_width=True)
+
+    # Perfilamento: uma execução completa sob cProfile, sem cache
+    st.sidebar.header("Diagnóstico")
+    profiling_mode = st.sidebar.checkbox(
+        "Modo de perfilamento (cProfile, ignora o cache)?", value=profile_default,
+        help="Mede onde o tempo é gasto no processo atual; o perfil fica disponível para download."
+    )
     
     # Seção de entrada do número do processo
     st.header("Processo Administrativo")
@@ -890,41 +3701,162 @@ def main():
         else:
             with st.spinner("Processando..."):
                 try:
-                    username_encrypted = cipher_suite.encrypt(st.session_state.username_input.encode('utf-8'))
-                    password_encrypted = cipher_suite.encrypt(st.session_state.password_input.encode('utf-8'))
-
-                    download_path = process_notification(
-                        username_encrypted,
-                        password_encrypted,
-                        st.session_state.process_number_input,
-                        headless=headless_option
-                    )
-                    st.success("PDF gerado/baixado com sucesso!")
-
-                    if download_path:
-                        pdf_file_name = os.path.basename(download_path)
-                        numero_processo = extract_process_number(pdf_file_name)
+                    credential_token = session_credential_token()
+
+                    if force_reprocess:
+                        invalidate_pipeline_cache(st.session_state.process_number_input)
+
+                    queue_status = st.empty()
+                    progress_bar = st.progress(0.0)
+                    partial_results = st.empty()
+
+                    def show_queue_position(position):
+                        if position:
+                            queue_status.info(
+                                f"Navegadores ocupados: você é o {position}º da fila. "
+                                "O processamento começa assim que houver vaga."
+                            )
+                        else:
+                            queue_status.empty()
+
+                    def show_page_progress(event):
+                        progress_bar.progress(
+                            min(event["page"] / max(event["total_pages"], 1), 1.0),
+                            text=f"Página {event['page']} de {event['total_pages']} ({event['origin']})"
+                        )
+                        partial_info = event["info"]
+                        partial_results.write(
+                            f"**Nome Autuado:** {partial_info.get('nome_autuado') or '...'} · "
+                            f"**CNPJ/CPF:** {partial_info.get('cnpj') or partial_info.get('cpf') or '...'} · "
+                            f"**Emails:** {len(partial_info.get('emails', []))}"
+                        )
 
-                        text_final, enderecos_ocr = extract_text_with_best_ocr(download_path)
+                    if profiling_mode:
+                        result, st.session_state['profile_artifact'] = profile_pipeline(
+                            st.session_state.process_number_input,
+                            credential_token,
+                            settings=extraction_settings,
+                            headless=headless_option,
+                            session_id=browser_session_id(),
+                            on_wait=show_queue_position
+                        )
+                    else:
+                        result = run_pipeline(
+                            st.session_state.process_number_input,
+                            credential_token,
+                            settings=extraction_settings,
+                            headless=headless_option,
+                            on_page=show_page_progress,
+                            on_wait=show_queue_position,
+                            session_id=browser_session_id(),
+                            refresh_pages=force_reprocess
+                        )
+                    progress_bar.empty()
+                    partial_results.empty()
+                    st.success("PDF gerado/baixado e texto extraído com sucesso!")
+
+                    report = result.get('extraction_report')
+                    if report and report.get('stopped_early'):
+                        st.info(
+                            f"Parada antecipada: {len(report['processed_pages'])} página(s) processada(s), "
+                            f"{len(report['skipped_pages'])} ignorada(s): {report['skipped_pages']}"
+                        )
+                    if report and report.get('ocr_quality'):
+                        with st.expander("Qualidade do OCR adaptativo (DPI e confiança por página)"):
+                            st.dataframe(
+                                pd.DataFrame(report['ocr_quality']).rename(columns={
+                                    "page": "Página",
+                                    "dpi": "DPI",
+                                    "confidence": "Confiança inicial",
+                                    "final_confidence": "Confiança final",
+                                    "regions": "Trechos refeitos",
+                                    "region_dpi": "DPI dos trechos",
+                                }),
+                                hide_index=True,
+                                use_container_width=True
+                            )
+                    if report and report.get('reused_pages'):
+                        st.info(
+                            f"{report['reused_pages']} página(s) já processada(s) anteriormente foram "
+                            "reaproveitadas; só as novas ou alteradas foram extraídas."
+                        )
 
-                        if text_final.strip():
-                            st.success("Texto extraído com sucesso!")
-                            info = extract_information_spacy(text_final)
-                            addresses_ar_ais = extract_addresses_with_source(text_final)
+                    # Guardar em session_state
+                    st.session_state['info'] = result['info']
+                    st.session_state['addresses_raw'] = result['addresses_raw']
+                    st.session_state['numero_processo'] = result['numero_processo']
+                    st.session_state['emails'] = result['emails']
+                    # Novo resultado: descartar edições de endereços anteriores
+                    st.session_state.pop('addresses_edited', None)
 
-                            # Unir endereços OCR e AR/AIS
-                            all_addresses = addresses_ar_ais + enderecos_ocr
+                except Exception as ex:
+                    st.error(f"Ocorreu um erro: {ex}")
 
-                            emails = extract_all_emails(info.get('emails', []))
+    # Último perfil gerado nesta sessão
+    profile_artifact = st.session_state.get('profile_artifact')
+    if profile_artifact:
+        with st.expander(f"Perfil de desempenho: {profile_artifact['tag']}"):
+            st.text(profile_artifact['summary'])
+            col_prof, col_summary = st.columns(2)
+            with open(profile_artifact['prof_path'], "rb") as prof_file:
+                col_prof.download_button(
+                    label="Baixar perfil (.prof)",
+                    data=prof_file.read(),
+                    file_name=os.path.basename(profile_artifact['prof_path']),
+                    mime="application/octet-stream"
+                )
+            col_summary.download_button(
+                label="Baixar resumo (.txt)",
+                data=profile_artifact['summary'],
+                file_name=os.path.basename(profile_artifact['summary_path']),
+                mime="text/plain"
+            )
 
-                            # Guardar em session_state
-                            st.session_state['info'] = info
-                            st.session_state['addresses_raw'] = all_addresses
-                            st.session_state['numero_processo'] = numero_processo
-                            st.session_state['emails'] = emails
+    # Processamento em lote (fila persistente em SQLite)
+    with st.expander("Processamento em Lote"):
+        st.write("Informe um número de processo por linha. Lotes interrompidos são retomados da última etapa concluída.")
+        batch_input = st.text_area("Números dos Processos", key="batch_input")
+        job_store = JobStore()
+        col_start, col_retry = st.columns(2)
+        start_batch = col_start.button("Processar Lote")
+        retry_batch = col_retry.button("Repetir Falhas")
+
+        if start_batch or retry_batch:
+            if not st.session_state.username_input or not st.session_state.password_input:
+                st.error("Por favor, preencha usuário e senha.")
+            else:
+                if retry_batch:
+                    job_store.retry_failed()
+                job_store.enqueue([line for line in batch_input.splitlines() if line.strip()])
+
+                credential_token = session_credential_token()
+                progress = st.empty()
+                with st.spinner("Processando lote..."):
+                    run_batch_worker(
+                        job_store,
+                        credential_token,
+                        settings=extraction_settings,
+                        headless=headless_option,
+                        on_progress=lambda process_number, stage: progress.write(
+                            f"Processo {process_number}: etapa '{stage}' executada."
+                        ),
+                        max_wait=120,
+                        session_id=browser_session_id()
+                    )
 
-                except Exception as ex:
-                    st.error(f"Ocorreu um erro: {ex}")
+        jobs = job_store.list_jobs()
+        if jobs:
+            st.dataframe([
+                {
+                    "Processo": job["process_number"],
+                    "Etapa": job["stage"],
+                    "Situação": job["status"],
+                    "Tentativas": job["attempts"],
+                    "Erro": job["error"] or "",
+                    "Documento": job["artifacts"].get("docx_path", ""),
+                }
+                for job in jobs
+            ])
 
     # Só exibimos as informações extraídas se tivermos st.session_state populado
     if 'info' in st.session_state and 'addresses_raw' in st.session_state:
@@ -946,31 +3878,10 @@ def main():
         # Exibir endereços com a origem (não iremos mostrar no documento final, mas só para referência)
         st.subheader("Endereços Encontrados")
         if "addresses_edited" not in st.session_state:
-            st.session_state['addresses_edited'] = st.session_state['addresses_raw'][:]
-
-        # Permitir exclusão e edição de cada endereço
-        for idx, end in enumerate(st.session_state['addresses_edited']):
-            st.write(f"**Endereço {idx+1}**:")
-            new_endereco = st.text_input(f"Endereço {idx+1}", value=end['endereco'], key=f"end_{idx}")
-            new_cidade = st.text_input(f"Cidade {idx+1}", value=end['cidade'], key=f"cid_{idx}")
-            new_bairro = st.text_input(f"Bairro {idx+1}", value=end['bairro'], key=f"bai_{idx}")
-            new_estado = st.text_input(f"Estado {idx+1}", value=end['estado'], key=f"est_{idx}")
-            new_cep = st.text_input(f"CEP {idx+1}", value=end['cep'], key=f"cep_{idx}")
-            
-            # Checkbox para excluir o endereço
-            exclude_address = st.checkbox("Excluir este endereço?", key=f"excluir_{idx}", value=False)
-
-            # Exibe a origem do endereço
-            st.write(f"Origem do endereço: {end.get('source', 'Desconhecido')}")
-            st.write("---")
-
-            # Atualizar dicionário em session_state
-            st.session_state['addresses_edited'][idx]['endereco'] = new_endereco
-            st.session_state['addresses_edited'][idx]['cidade']   = new_cidade
-            st.session_state['addresses_edited'][idx]['bairro']   = new_bairro
-            st.session_state['addresses_edited'][idx]['estado']   = new_estado
-            st.session_state['addresses_edited'][idx]['cep']      = new_cep
-            st.session_state['addresses_edited'][idx]['excluded'] = exclude_address
+            st.session_state['addresses_edited'] = [dict(a) for a in st.session_state['addresses_raw']]
+
+        # Edição em tabela paginada (uma única atualização de 'addresses_edited' por rerun)
+        render_address_editor()
 
         # Selecionar email
         st.subheader("Selecionar Email para Utilizar no Processo")
@@ -1109,4 +4020,9 @@ if __name__ == '__main__':
         os.system("python -m spacy download pt_core_news_lg")
         nlp = spacy.load("pt_core_news_lg")
 
-    main()
+    # Argumentos após '--': streamlit run anavisa.py -- --profile
+    cli_parser = argparse.ArgumentParser()
+    cli_parser.add_argument("--profile", action="store_true", help="Inicia com o modo de perfilamento ligado")
+    cli_args, _ = cli_parser.parse_known_args()
+
+    main(profile_default=cli_args.profile)
@@ -0,0 +1,429 @@
+"""
+Benchmarks das etapas do pipeline sobre um corpus sintético.
+
+Uso:
+    python benchmark.py preprocess --pages 5
+    python benchmark.py --tesseract-cmd /usr/bin/tesseract ocr-backend --pages 10
+    python benchmark.py parser --pages 5000
+    python benchmark.py ner --sizes 1,10,100 --processes 4
+    python benchmark.py adaptive-dpi --pages 10 --low-dpi 150 --min-confidence 70
+"""
+import argparse
+import difflib
+import random
+import re
+import time
+
+import numpy as np
+import pytesseract
+import spacy
+from PIL import Image, ImageDraw, ImageFont
+
+import anavisa
+
+###############################################################################
+# Corpus sintético
+###############################################################################
+PAGE_SIZE_300DPI = (2480, 3508)  # A4
+
+LINHAS_MODELO = [
+    "AVISO DE RECEBIMENTO - AR",
+    "Destinatario: {nome}",
+    "CNPJ: {cnpj}",
+    "Endereco: Rua {rua}, {numero}, Sala {sala}",
+    "Bairro: {bairro}",
+    "Cidade: {cidade}",
+    "Estado: {uf}",
+    "CEP: {cep}",
+    "Processo Administrativo Sancionador",
+]
+
+NOMES = ["Farmacia Boa Saude Ltda", "Distribuidora Vida Nova SA", "Drogaria Central ME"]
+RUAS = ["das Flores", "Marechal Deodoro", "Sete de Setembro", "Dom Pedro II"]
+BAIRROS = ["Centro", "Jardim America", "Vila Mariana", "Boa Vista"]
+CIDADES = [("Brasilia", "DF", "70040-010"), ("Sao Paulo", "SP", "01310-100"), ("Recife", "PE", "50030-230")]
+
+def _load_font(size):
+    for name in ("DejaVuSans.ttf", "arial.ttf", "Arial.ttf"):
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    return ImageFont.load_default()
+
+def synthetic_page(seed, dpi=300, stamp_contrast=35, skew=0.0):
+    """
+    Gera uma página de AR digitalizada: iluminação irregular, ruído,
+    texto principal escuro e um carimbo fraco (cinza claro).
+    Retorna (imagem, texto_verdadeiro, máscara_do_carimbo, máscara_do_texto).
+    """
+    rng = random.Random(seed)
+    scale = dpi / 300.0
+    width, height = int(PAGE_SIZE_300DPI[0] * scale), int(PAGE_SIZE_300DPI[1] * scale)
+    font = _load_font(int(42 * scale))
+
+    cidade, uf, cep = rng.choice(CIDADES)
+    campos = {
+        "nome": rng.choice(NOMES),
+        "cnpj": "11.222.333/0001-81",
+        "rua": rng.choice(RUAS),
+        "numero": rng.randint(10, 9999),
+        "sala": rng.randint(1, 50),
+        "bairro": rng.choice(BAIRROS),
+        "cidade": cidade,
+        "uf": uf,
+        "cep": cep,
+    }
+    linhas = [linha.format(**campos) for linha in LINHAS_MODELO]
+
+    text_layer = Image.new('L', (width, height), 0)
+    draw = ImageDraw.Draw(text_layer)
+    y = int(200 * scale)
+    for linha in linhas:
+        draw.text((int(180 * scale), y), linha, fill=255, font=font)
+        y += int(90 * scale)
+
+    stamp_text = f"RECEBIDO EM {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2023"
+    stamp_layer = Image.new('L', (width, height), 0)
+    ImageDraw.Draw(stamp_layer).text((int(900 * scale), y + int(200 * scale)), stamp_text, fill=255, font=font)
+
+    # Fundo com iluminação irregular e ruído de digitalização
+    gradient = np.linspace(235, 170, width)[None, :].repeat(height, axis=0)
+    noise = np.random.default_rng(seed).normal(0, 8, (height, width))
+    page = gradient + noise
+    text_mask = np.asarray(text_layer) > 127
+    page[text_mask] = 30
+    stamp_mask = np.asarray(stamp_layer) > 127
+    # Carimbo fraco: apenas alguns tons abaixo do fundo local
+    page[stamp_mask] -= stamp_contrast
+    page = np.clip(page, 0, 255).astype(np.uint8)
+
+    image = Image.fromarray(page, mode='L').convert('RGB')
+    if skew:
+        image = image.rotate(skew, expand=True, fillcolor=(255, 255, 255))
+        stamp_mask = _rotate_mask(stamp_mask, skew)
+        text_mask = _rotate_mask(text_mask, skew)
+
+    return image, "\n".join(linhas + [stamp_text]), stamp_mask, text_mask
+
+def _rotate_mask(mask, angle):
+    rotated = Image.fromarray((mask * 255).astype(np.uint8)).rotate(angle, expand=True, fillcolor=0)
+    return np.asarray(rotated) > 127
+
+def synthetic_corpus(pages, dpi=300, skew_every=3):
+    return [
+        synthetic_page(seed, dpi=dpi, skew=(1.5 if skew_every and seed % skew_every == 2 else 0.0))
+        for seed in range(pages)
+    ]
+
+def tesseract_available():
+    try:
+        pytesseract.get_tesseract_version()
+        return True
+    except Exception:
+        return False
+
+def text_accuracy(expected, obtained):
+    return difflib.SequenceMatcher(None, anavisa.normalize_text(expected), anavisa.normalize_text(obtained)).ratio()
+
+###############################################################################
+# Benchmarks
+###############################################################################
+PREPROCESS_VARIANTS = {
+    "pil (limiar 128)": {"preprocess": "pil"},
+    "otsu": {"preprocess": "otsu"},
+    "sauvola": {"preprocess": "sauvola"},
+    "sauvola + deskew + crop": {"preprocess": "sauvola", "deskew": True, "crop_borders": True},
+}
+
+def bench_preprocess(args):
+    corpus = synthetic_corpus(args.pages, dpi=args.dpi)
+    run_ocr = tesseract_available() and not args.no_ocr
+    if not run_ocr:
+        print("Tesseract indisponível: medindo apenas tempo e retenção do carimbo fraco.")
+
+    # carimbo: fração do carimbo fraco preservada como tinta
+    # ruído: fração do fundo marcada como tinta (falsos positivos)
+    print(f"{'variante':<26}{'ms/página':>11}{'carimbo':>10}{'ruído':>9}{'acurácia OCR':>15}")
+    for name, overrides in PREPROCESS_VARIANTS.items():
+        settings = anavisa.resolve_extraction_settings(overrides)
+        elapsed = 0.0
+        retention = []
+        noise = []
+        accuracy = []
+        for image, expected, stamp_mask, text_mask in corpus:
+            start = time.perf_counter()
+            processed = anavisa.preprocess_page(image, settings)
+            elapsed += time.perf_counter() - start
+
+            ink = np.asarray(processed.convert('L')) < 128
+            if ink.shape == stamp_mask.shape:
+                retention.append(ink[stamp_mask].mean())
+                noise.append(ink[~stamp_mask & ~text_mask].mean())
+
+            if run_ocr:
+                text = pytesseract.image_to_string(processed, config=f"--psm 6 --oem 3 -l {args.lang}")
+                accuracy.append(text_accuracy(expected, text))
+
+        ms_per_page = 1000 * elapsed / len(corpus)
+        retention_str = f"{100 * np.mean(retention):.1f}%" if retention else "n/d"
+        noise_str = f"{100 * np.mean(noise):.1f}%" if noise else "n/d"
+        accuracy_str = f"{100 * np.mean(accuracy):.1f}%" if accuracy else "n/d"
+        print(f"{name:<26}{ms_per_page:>11.1f}{retention_str:>10}{noise_str:>9}{accuracy_str:>15}")
+
+def bench_ocr_backend(args):
+    if not tesseract_available():
+        print("Tesseract indisponível: informe o executável com --tesseract-cmd.")
+        return
+
+    settings = anavisa.resolve_extraction_settings()
+    corpus = synthetic_corpus(args.pages)
+    images = [anavisa.preprocess_page(image, settings) for image, _, _, _ in corpus]
+    expected = [text for _, text, _, _ in corpus]
+
+    backends = [b for b in anavisa.OCR_BACKENDS if b != "tesserocr" or anavisa.tesserocr is not None]
+    print(f"{'motor':<14}{'ms/página':>11}{'acurácia OCR':>15}")
+    for backend in backends:
+        # Primeira chamada fora da medição (carga inicial do tesserocr)
+        anavisa.ocr_images(images[:1], lang=args.lang, backend=backend)
+        start = time.perf_counter()
+        texts = anavisa.ocr_images(images, lang=args.lang, backend=backend)
+        elapsed = time.perf_counter() - start
+        accuracy = np.mean([text_accuracy(e, t) for e, t in zip(expected, texts)])
+        print(f"{backend:<14}{1000 * elapsed / len(images):>11.1f}{100 * accuracy:>14.1f}%")
+
+def legacy_findall_parser(text):
+    """
+    Parser anterior (um findall por campo, pareados pelo índice da lista),
+    mantido aqui apenas como referência de tempo e de alinhamento.
+    """
+    patterns = [
+        r"(?:Endereço|End|Endereco):\s*([\w\s.,ºª-]+)",
+        r"Cidade:\s*([\w\s]+(?: DE [\w\s]+)?)",
+        r"Bairro:\s*([\w\s]+)",
+        r"Estado:\s*([A-Z]{2})",
+        r"CEP:\s*(\d{2}\.\d{3}-\d{3}|\d{5}-\d{3})",
+    ]
+    addresses = []
+    for block in text.split("\f"):
+        matches = [re.findall(pattern, block, re.IGNORECASE) for pattern in patterns]
+        for i in range(max(len(m) for m in matches)):
+            values = [m[i].strip() if i < len(m) else "[Não informado]" for m in matches]
+            if len(values[0]) < 15:
+                continue
+            addresses.append(dict(zip(("endereco", "cidade", "bairro", "estado", "cep"), values)))
+    return addresses
+
+def synthetic_ocr_text(pages, addresses_per_page=6, missing_every=4, seed=0):
+    """
+    Texto de OCR com vários blocos de endereço por página; a cada `missing_every`
+    blocos o Bairro é omitido (caso que desalinhava o parser antigo).
+    Retorna (texto, lista de cidades esperadas, na ordem).
+    """
+    rng = random.Random(seed)
+    page_texts = []
+    expected_cities = []
+    block_count = 0
+    for _ in range(pages):
+        lines = ["AVISO DE RECEBIMENTO - AR", "Destinatario: " + rng.choice(NOMES)]
+        for _ in range(addresses_per_page):
+            cidade, uf, cep = rng.choice(CIDADES)
+            lines.append(f"Endereco: Rua {rng.choice(RUAS)}, {rng.randint(10, 9999)}, Sala {rng.randint(1, 50)}")
+            if block_count % missing_every:
+                lines.append(f"Bairro: {rng.choice(BAIRROS)}")
+            lines.append(f"Cidade: {cidade}")
+            lines.append(f"Estado: {uf}")
+            lines.append(f"CEP: {cep}")
+            lines.append("Observacoes gerais do documento, sem endereco.")
+            expected_cities.append(cidade)
+            block_count += 1
+        page_texts.append("\n".join(lines))
+    return "\f".join(page_texts), expected_cities
+
+# Entradas que não podem virar endereço (ou campos de endereço), com o esperado
+PARSER_REGRESSION_CASES = [
+    ("Endereço eletrônico: contato@farmaciaboa.com.br", []),
+    ("Endereco eletronico: contato@farmaciaboa.com.br", []),
+    ("Endereço de e-mail: contato@farmaciaboa.com.br", []),
+    ("Endereço: contato@farmaciaboa.com.br", []),
+    ("A empresa, sediada no Estado de São Paulo, na cidade de Campinas, foi autuada.", []),
+    (
+        "Endereço: Rua das Flores, 123, Sala 4\nno Estado de São Paulo, na cidade de Campinas, foi autuada.\n"
+        "Cidade: Campinas\nEstado: SP\nCEP: 13010-000",
+        [{"endereco": "Rua das Flores, 123, Sala 4", "cidade": "Campinas", "estado": "SP", "cep": "13010-000"}],
+    ),
+]
+
+def _address(endereco, cep="[Não informado]", estado="[Não informado]", source="AR"):
+    return {"endereco": endereco, "cidade": "[Não informado]", "bairro": "[Não informado]",
+            "estado": estado, "cep": cep, "source": source}
+
+# Deduplicação: (endereços, quantidade esperada após deduplicate_addresses)
+DEDUP_REGRESSION_CASES = [
+    # Imóveis diferentes na mesma rua não são o mesmo destinatário
+    ([_address("Rua Marechal Deodoro, 1200, Sala 4", estado="PR"),
+      _address("Rua Marechal Deodoro, 1500, Sala 9", estado="PR", source="AIS")], 2),
+    ([_address("Avenida Paulista, 1000", cep="01310-100"), _address("Avenida Paulista, 2000")], 2),
+    # Sem números, a rua casaria com os dois imóveis: a união não pode ser transitiva
+    ([_address("Rua Marechal Deodoro, 1200", estado="PR"), _address("Rua Marechal Deodoro, 1500", estado="PR"),
+      _address("Rua Marechal Deodoro", estado="PR")], 2),
+    # O mesmo endereço com e sem CEP/UF e com erro de OCR continua sendo um só
+    ([_address("Rua das Flores, 123, Sala 4", cep="70040-010", estado="DF"),
+      _address("Rua das Flores, 123, Sala 4", estado="DF", source="AIS"),
+      _address("Rua das Fl0res, 123, Sala 4", source="OCR")], 1),
+]
+
+def check_parser_regressions():
+    failures = 0
+    for addresses, expected in DEDUP_REGRESSION_CASES:
+        obtained = anavisa.deduplicate_addresses(addresses)
+        if len(obtained) != expected:
+            failures += 1
+            print(f"FALHA (deduplicação): esperado {expected} endereço(s)\n  obtido: {obtained}")
+    for text, expected in PARSER_REGRESSION_CASES:
+        records = anavisa.parse_address_records(text, "teste")
+        obtained = [
+            {field: record[field] for field in expected[i]} if i < len(expected) else record
+            for i, record in enumerate(records)
+        ]
+        if obtained != expected:
+            failures += 1
+            print(f"FALHA: {text!r}\n  esperado: {expected}\n  obtido:   {records}")
+    total = len(PARSER_REGRESSION_CASES) + len(DEDUP_REGRESSION_CASES)
+    print(f"Casos de regressão: {total - failures}/{total} ok\n")
+
+def bench_parser(args):
+    check_parser_regressions()
+    text, expected_cities = synthetic_ocr_text(args.pages)
+    print(f"Texto sintético: {len(text) / 1e6:.1f} MB, {len(expected_cities)} endereços")
+    print(f"{'parser':<22}{'tempo (s)':>11}{'MB/s':>8}{'registros':>11}{'alinhados':>11}")
+    for name, parse in (("findall por campo", legacy_findall_parser), ("registro (1 passada)", anavisa.extract_addresses_with_source)):
+        start = time.perf_counter()
+        addresses = parse(text)
+        elapsed = time.perf_counter() - start
+        aligned = sum(1 for a, cidade in zip(addresses, expected_cities) if a["cidade"].strip() == cidade)
+        print(f"{name:<22}{elapsed:>11.2f}{len(text) / 1e6 / elapsed:>8.1f}{len(addresses):>11}{100 * aligned / len(expected_cities):>10.1f}%")
+
+def synthetic_text_of_size(megabytes):
+    """
+    Texto sintético (páginas separadas por \\f) com aproximadamente `megabytes` MB.
+    """
+    page_text, _ = synthetic_ocr_text(1)
+    pages = max(1, int(megabytes * 1e6 / (len(page_text) + 1)))
+    text, _ = synthetic_ocr_text(pages)
+    return text
+
+def bench_ner(args):
+    anavisa.nlp = spacy.load(args.model)
+    sizes = [float(size) for size in args.sizes.split(",")]
+    print(f"{'MB':>6}  {'modo':<28}{'tempo (s)':>11}{'MB/s':>8}{'entidades':>11}")
+    for megabytes in sizes:
+        text = synthetic_text_of_size(megabytes)
+        size_mb = len(text) / 1e6
+
+        # Texto inteiro num único nlp(): falha acima de nlp.max_length
+        start = time.perf_counter()
+        try:
+            count = len(anavisa.nlp(text).ents)
+            elapsed = time.perf_counter() - start
+            result = f"{elapsed:>11.2f}{size_mb / elapsed:>8.2f}{count:>11}"
+        except ValueError:
+            result = f"{'max_length':>11}{'-':>8}{'-':>11}"
+        print(f"{size_mb:>6.1f}  {'nlp(texto inteiro)':<28}{result}")
+
+        for n_process in sorted({1, args.processes}):
+            start = time.perf_counter()
+            entities = anavisa.extract_entities(
+                anavisa.iter_page_texts(text), batch_size=args.batch_size, n_process=n_process
+            )
+            elapsed = time.perf_counter() - start
+            mode = f"nlp.pipe ({n_process} processo{'s' if n_process > 1 else ''})"
+            print(f"{size_mb:>6.1f}  {mode:<28}{elapsed:>11.2f}{size_mb / elapsed:>8.2f}{len(entities):>11}")
+
+def bench_adaptive_dpi(args):
+    if not tesseract_available():
+        print("Tesseract indisponível: informe o executável com --tesseract-cmd.")
+        return
+
+    settings = anavisa.resolve_extraction_settings({
+        "lang": args.lang,
+        "adaptive_low_dpi": args.low_dpi,
+        "adaptive_min_confidence": args.min_confidence,
+    })
+    config = anavisa.tesseract_config(settings["lang"], settings["psm_mode"], settings["oem_mode"])
+
+    # A rasterização (aqui, a geração da página sintética) entra no tempo dos dois modos
+    print(f"{'modo':<24}{'ms/página':>11}{'acurácia OCR':>15}")
+    start = time.perf_counter()
+    accuracy = []
+    for seed in range(args.pages):
+        image, expected, _, _ = synthetic_page(seed, dpi=settings["dpi"], skew=0.0)
+        text = pytesseract.image_to_string(anavisa.preprocess_page(image, settings), config=config)
+        accuracy.append(text_accuracy(expected, text))
+    elapsed = time.perf_counter() - start
+    print(f"{'fixo ' + str(settings['dpi']) + ' dpi':<24}{1000 * elapsed / args.pages:>11.1f}{100 * np.mean(accuracy):>14.1f}%")
+
+    start = time.perf_counter()
+    accuracy = []
+    qualities = []
+    for seed in range(args.pages):
+        low_image, expected, _, _ = synthetic_page(seed, dpi=args.low_dpi, skew=0.0)
+        text, quality = anavisa.ocr_page_adaptive(
+            low_image, settings, lambda seed=seed: synthetic_page(seed, dpi=settings["dpi"], skew=0.0)[0]
+        )
+        accuracy.append(text_accuracy(expected, text))
+        qualities.append(quality)
+    elapsed = time.perf_counter() - start
+    print(f"{'adaptativo':<24}{1000 * elapsed / args.pages:>11.1f}{100 * np.mean(accuracy):>14.1f}%")
+
+    low_only = sum(1 for q in qualities if q["dpi"] == args.low_dpi and not q["regions"])
+    regions = sum(1 for q in qualities if q["regions"])
+    full_page = sum(1 for q in qualities if q["dpi"] != args.low_dpi)
+    print(f"\nPáginas só em {args.low_dpi} dpi: {low_only}; com trechos refeitos: {regions}; "
+          f"refeitas inteiras: {full_page}")
+    print(f"{'página':>7}{'dpi':>6}{'confiança':>11}{'final':>8}{'trechos':>9}")
+    for seed, quality in enumerate(qualities):
+        print(f"{seed:>7}{quality['dpi']:>6}{quality['confidence']:>11.1f}{quality['final_confidence']:>8.1f}{quality['regions']:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tesseract-cmd", help="Caminho do executável do Tesseract")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="Pré-processamento PIL x NumPy (tempo e acurácia)")
+    preprocess_parser.add_argument("--pages", type=int, default=5)
+    preprocess_parser.add_argument("--dpi", type=int, default=300)
+    preprocess_parser.add_argument("--lang", default="por")
+    preprocess_parser.add_argument("--no-ocr", action="store_true", help="Não executa o Tesseract")
+    preprocess_parser.set_defaults(func=bench_preprocess)
+
+    backend_parser = subparsers.add_parser("ocr-backend", help="Custo por página de cada motor de OCR")
+    backend_parser.add_argument("--pages", type=int, default=10)
+    backend_parser.add_argument("--lang", default="por")
+    backend_parser.set_defaults(func=bench_ocr_backend)
+
+    parser_parser = subparsers.add_parser("parser", help="Parser de endereços: findall por campo x registro")
+    parser_parser.add_argument("--pages", type=int, default=5000)
+    parser_parser.set_defaults(func=bench_parser)
+
+    ner_parser = subparsers.add_parser("ner", help="NER: texto inteiro x blocos com nlp.pipe")
+    ner_parser.add_argument("--sizes", default="1,10,100", help="Tamanhos do texto em MB, separados por vírgula")
+    ner_parser.add_argument("--model", default="pt_core_news_lg")
+    ner_parser.add_argument("--batch-size", type=int, default=32)
+    ner_parser.add_argument("--processes", type=int, default=4)
+    ner_parser.set_defaults(func=bench_ner)
+
+    adaptive_parser = subparsers.add_parser("adaptive-dpi", help="OCR em DPI fixo x adaptativo (tempo, acurácia e DPI por página)")
+    adaptive_parser.add_argument("--pages", type=int, default=10)
+    adaptive_parser.add_argument("--lang", default="por")
+    adaptive_parser.add_argument("--low-dpi", type=int, default=150)
+    adaptive_parser.add_argument("--min-confidence", type=float, default=70)
+    adaptive_parser.set_defaults(func=bench_adaptive_dpi)
+
+    args = parser.parse_args()
+    if args.tesseract_cmd:
+        pytesseract.pytesseract.tesseract_cmd = args.tesseract_cmd
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+"""
+Índice local de CEPs em arquivo binário mapeado em memória (mmap).
+
+Formato (little-endian):
+    cabeçalho:  b"CEPIDX01" | uint32 quantidade | uint32 início_dos_textos
+    chaves:     quantidade x uint32 (CEP como inteiro, ordenado)
+    posições:   quantidade x uint32 (deslocamento do registro na área de textos)
+    textos:     por registro, uint16 tamanho + "logradouro\\x1fbairro\\x1fcidade\\x1fUF" (UTF-8)
+
+A busca é binária direto sobre o arquivo mapeado: nada é carregado para a memória
+além das páginas lidas pelo sistema operacional.
+
+Construção a partir de um CSV (colunas cep, logradouro, bairro, cidade, uf):
+    python cep_index.py base_ceps.csv cep_index.bin
+"""
+import argparse
+import codecs
+import csv
+import mmap
+import re
+import struct
+
+MAGIC = b"CEPIDX01"
+HEADER = struct.Struct("<8sII")
+UINT32 = struct.Struct("<I")
+UINT16 = struct.Struct("<H")
+FIELD_SEPARATOR = "\x1f"
+
+# Nomes de coluna aceitos no CSV para cada campo
+CSV_COLUMNS = {
+    "cep": ("cep",),
+    "logradouro": ("logradouro", "endereco", "endereço", "rua"),
+    "bairro": ("bairro",),
+    "cidade": ("cidade", "localidade", "municipio", "município"),
+    "uf": ("uf", "estado", "sigla_uf"),
+}
+
+# Faixas de CEP (5 primeiros dígitos) por UF, segundo os Correios
+CEP_UF_RANGES = (
+    (1000, 19999, "SP"), (20000, 28999, "RJ"), (29000, 29999, "ES"),
+    (30000, 39999, "MG"), (40000, 48999, "BA"), (49000, 49999, "SE"),
+    (50000, 56999, "PE"), (57000, 57999, "AL"), (58000, 58999, "PB"),
+    (59000, 59999, "RN"), (60000, 63999, "CE"), (64000, 64999, "PI"),
+    (65000, 65999, "MA"), (66000, 68899, "PA"), (68900, 68999, "AP"),
+    (69000, 69299, "AM"), (69300, 69399, "RR"), (69400, 69899, "AM"),
+    (69900, 69999, "AC"), (70000, 72799, "DF"), (72800, 72999, "GO"),
+    (73000, 73699, "DF"), (73700, 76799, "GO"), (76800, 76999, "RO"),
+    (77000, 77999, "TO"), (78000, 78899, "MT"), (79000, 79999, "MS"),
+    (80000, 87999, "PR"), (88000, 89999, "SC"), (90000, 99999, "RS"),
+)
+
+def cep_to_int(cep):
+    """
+    Converte '70.040-010', '70040-010' ou '70040010' em inteiro; None se inválido.
+    """
+    digits = re.sub(r"\D", "", cep or "")
+    if len(digits) != 8:
+        return None
+    return int(digits)
+
+def uf_for_cep(cep):
+    """
+    UF esperada para o CEP pela faixa dos Correios (não depende do índice).
+    """
+    value = cep_to_int(cep)
+    if value is None:
+        return None
+    prefix = value // 1000
+    for start, end, uf in CEP_UF_RANGES:
+        if start <= prefix <= end:
+            return uf
+    return None
+
+def _resolve_columns(header):
+    normalized = [h.strip().lower() for h in header]
+    columns = {}
+    for field, names in CSV_COLUMNS.items():
+        for name in names:
+            if name in normalized:
+                columns[field] = normalized.index(name)
+                break
+    return columns
+
+def _read_csv(csv_path, encoding):
+    # CSVs exportados pelo Excel começam com BOM; utf-8-sig o remove (e lê UTF-8 sem BOM normalmente)
+    if codecs.lookup(encoding).name == "utf-8":
+        encoding = "utf-8-sig"
+    with open(csv_path, newline="", encoding=encoding) as csv_file:
+        sample = csv_file.read(4096)
+        csv_file.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;|\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.reader(csv_file, dialect)
+
+        first_row = next(reader, None)
+        if first_row is None:
+            return
+        columns = _resolve_columns(first_row)
+        if "cep" not in columns:
+            # Sem cabeçalho: ordem padrão cep, logradouro, bairro, cidade, uf
+            columns = {field: idx for idx, field in enumerate(CSV_COLUMNS)}
+            yield first_row, columns
+
+        for row in reader:
+            yield row, columns
+
+def build_cep_index(csv_path, index_path, encoding="utf-8-sig"):
+    """
+    Lê o CSV, ordena por CEP e grava o índice binário. CEPs repetidos mantêm a
+    primeira ocorrência. Retorna a quantidade de CEPs indexados.
+    """
+    records = {}
+    for row, columns in _read_csv(csv_path, encoding):
+        def value(field):
+            idx = columns.get(field)
+            if idx is None or idx >= len(row):
+                return ""
+            return row[idx].strip().replace(FIELD_SEPARATOR, " ")
+
+        cep = cep_to_int(value("cep"))
+        if cep is None or cep in records:
+            continue
+        records[cep] = FIELD_SEPARATOR.join(
+            (value("logradouro"), value("bairro"), value("cidade"), value("uf").upper())
+        ).encode("utf-8")[:0xFFFF]
+
+    keys = sorted(records)
+    strings = bytearray()
+    offsets = []
+    for cep in keys:
+        offsets.append(len(strings))
+        strings += UINT16.pack(len(records[cep]))
+        strings += records[cep]
+
+    strings_start = HEADER.size + 8 * len(keys)
+    with open(index_path, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, len(keys), strings_start))
+        index_file.write(struct.pack(f"<{len(keys)}I", *keys))
+        index_file.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        index_file.write(strings)
+    return len(keys)
+
+class CepIndex:
+    """
+    Leitura do índice binário via mmap. Cada consulta faz uma busca binária
+    (~23 comparações para todo o Brasil) sem carregar o arquivo.
+    """
+
+    def __init__(self, index_path):
+        self.index_path = index_path
+        self._file = open(index_path, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._count, self._strings_start = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Arquivo {index_path} não é um índice de CEP válido.")
+        self._keys_start = HEADER.size
+        self._offsets_start = HEADER.size + 4 * self._count
+
+    def __len__(self):
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if getattr(self, "_mm", None) is not None:
+            self._mm.close()
+            self._mm = None
+        if getattr(self, "_file", None) is not None:
+            self._file.close()
+            self._file = None
+
+    def _key_at(self, position):
+        return UINT32.unpack_from(self._mm, self._keys_start + 4 * position)[0]
+
+    def lookup(self, cep):
+        """
+        Retorna {'logradouro', 'bairro', 'cidade', 'uf'} do CEP ou None se ausente.
+        """
+        value = cep_to_int(cep)
+        if value is None:
+            return None
+
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key_at(middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low >= self._count or self._key_at(low) != value:
+            return None
+
+        offset = self._strings_start + UINT32.unpack_from(self._mm, self._offsets_start + 4 * low)[0]
+        length = UINT16.unpack_from(self._mm, offset)[0]
+        data = self._mm[offset + 2:offset + 2 + length].decode("utf-8")
+        logradouro, bairro, cidade, uf = data.split(FIELD_SEPARATOR)
+        return {"logradouro": logradouro, "bairro": bairro, "cidade": cidade, "uf": uf}
+
+def main():
+    parser = argparse.ArgumentParser(description="Constrói o índice binário de CEPs a partir de um CSV.")
+    parser.add_argument("csv_path", help="CSV com colunas cep, logradouro, bairro, cidade, uf")
+    parser.add_argument("index_path", help="Arquivo de saída (ex.: cep_index.bin)")
+    parser.add_argument("--encoding", default="utf-8-sig", help="Codificação do CSV (ex.: latin-1)")
+    args = parser.parse_args()
+
+    count = build_cep_index(args.csv_path, args.index_path, encoding=args.encoding)
+    print(f"{count} CEPs indexados em {args.index_path}")
+
+if __name__ == '__main__':
+    main()